@@ -0,0 +1,231 @@
+"""batch.py
+
+Score every entry against every scenario at once with NumPy.
+
+A scenario is a set of switched trees from `hypo_bracket.get_every_tree(depth)`,
+same as in `scenarios.test_scenarios`. Instead of switching and rescoring
+MatchupTrees one path at a time, build a (scenarios x games) matrix of
+winners and an (entries x games) matrix of picks, and get the whole
+(scenarios x entries) score table from a single matrix product.
+"""
+import numpy as np
+
+from bracket import TEAMS, ArrayBracket, get_game_weights, get_heap_nodes
+
+
+def get_scenario_slots(hypo_bracket, depth=3):
+  """Locate the trees from `hypo_bracket.get_every_tree(depth)` in heap order.
+
+  Returns (slots, sides): the heap slot of each tree, and whether its
+  current winner is the second of its two children in canonical order.
+  """
+  nodes = get_heap_nodes(hypo_bracket)
+  slot_by_id = {id(node): slot for slot, node in enumerate(nodes)}
+
+  slots = []
+  sides = []
+  for tree in hypo_bracket.get_every_tree(depth):
+    slot = slot_by_id[id(tree)]
+    slots.append(slot)
+    sides.append(nodes[2 * slot + 1] is not tree.winner)
+
+  return np.array(slots), np.array(sides)
+
+
+def paths_to_switches(paths):
+  """Convert '0'/'1' path strings into a (scenarios x trees) bool array."""
+  num_trees = len(paths[0]) if len(paths) else 0
+  chars = np.frombuffer(''.join(paths).encode(), dtype=np.uint8)
+  return chars.reshape(len(paths), num_trees) == ord('1')
+
+
+def masks_to_switches(masks, num_trees):
+  """Convert int scenario masks (bit i = tree i switched) into a bool array."""
+  masks = np.asarray(masks, dtype=np.uint64)
+  return (masks[:, None] >> np.arange(num_trees, dtype=np.uint64)) & np.uint64(1) == 1
+
+
+def get_outcome_matrix(hypo_bracket, switches, depth=3, teams=TEAMS):
+  """Winner of every game in every scenario, as a (scenarios x games) array.
+
+  switches (bool array): one row per scenario, one column per tree from
+    `hypo_bracket.get_every_tree(depth)`; True means that tree is switched.
+  """
+  base = ArrayBracket.from_tree(hypo_bracket, teams=teams)
+  slots, sides = get_scenario_slots(hypo_bracket, depth)
+  return resolve_outcomes(base, slots, sides, switches)
+
+
+def resolve_outcomes(base, slots, sides, switches):
+  """Like `get_outcome_matrix`, starting from an ArrayBracket and its scenario slots."""
+  winners = np.tile(base.winners, (len(switches), 1))
+
+  # Resolve the bottom of the bracket first so winners can move upward.
+  for i in np.argsort(-slots):
+    slot = slots[i]
+    use_second = switches[:, i] != sides[i]
+    winners[:, slot] = np.where(use_second, winners[:, 2 * slot + 2], winners[:, 2 * slot + 1])
+
+  return winners[:, :base.num_games]
+
+
+def get_pick_matrix(brackets, teams=TEAMS):
+  """Stack entries' picks into an (entries x games) array.
+
+  brackets (iterable): MatchupTree or ArrayBracket objects.
+  """
+  rows = [
+    b.games if isinstance(b, ArrayBracket) else ArrayBracket.from_tree(b, teams=teams).games
+    for b in brackets
+  ]
+  return np.stack(rows)
+
+
+def get_weights(base, rules=None):
+  """Points per game for `base` (an ArrayBracket): `rules` compiled, or 320 points per round."""
+  if rules is None:
+    return get_game_weights(base.num_games)
+  return rules.compile(base)
+
+
+def iter_outcome_chunks(base, slots, sides, chunk_size=2 ** 16, start=0, stop=None):
+  """Yield (first mask, switches, outcomes) for scenario masks `start` up to `stop`, a chunk at a time.
+
+  slots, sides: from `get_scenario_slots`. stop defaults to every scenario.
+  """
+  if stop is None:
+    stop = 2 ** len(slots)
+  for chunk_start in range(start, stop, chunk_size):
+    masks = np.arange(chunk_start, min(chunk_start + chunk_size, stop), dtype=np.uint64)
+    switches = masks_to_switches(masks, len(slots))
+    yield chunk_start, switches, resolve_outcomes(base, slots, sides, switches)
+
+
+def get_weight_table(weights, num_teams):
+  """Points for a correct pick as a (games x teams) table.
+
+  weights: points per game (eg `get_game_weights`), whoever wins it, or
+    already a per-game, per-team table (eg `ScoringRules.compile`).
+  """
+  if weights.ndim == 2:
+    return weights
+  return np.broadcast_to(weights[:, None], (len(weights), num_teams))
+
+
+def get_score_table(outcomes, picks, weights=None):
+  """Score every entry in every scenario, as a (scenarios x entries) array.
+
+  Games that come out the same in every scenario are scored once per
+  entry. The rest are one-hot encoded by winner, so the variable part of
+  the table is one matrix product.
+
+  weights: see `get_weight_table`. Defaults to 320 points per round.
+  """
+  if weights is None:
+    weights = get_game_weights(outcomes.shape[1])
+  weights = get_weight_table(weights, int(outcomes.max()) + 1)
+
+  varies = (outcomes != outcomes[0]).any(axis=0)
+
+  fixed = np.flatnonzero(~varies)
+  winners_fixed = outcomes[0, fixed]
+  scores_fixed = (picks[:, fixed] == winners_fixed) @ weights[fixed, winners_fixed]
+
+  cols_scenario = []
+  cols_entry = []
+  for game in np.flatnonzero(varies):
+    for team_id in np.unique(outcomes[:, game]):
+      cols_scenario.append(outcomes[:, game] == team_id)
+      cols_entry.append(weights[game, team_id] * (picks[:, game] == team_id))
+
+  if not cols_scenario:
+    return np.tile(scores_fixed, (len(outcomes), 1))
+
+  onehot_scenario = np.stack(cols_scenario, axis=1).astype(weights.dtype)
+  weights_entry = np.stack(cols_entry, axis=1)
+
+  return onehot_scenario @ weights_entry.T + scores_fixed
+
+
+def get_score_table_gray(hypo_bracket, picks, depth=3, weights=None, teams=TEAMS):
+  """Same table as `get_score_table`, built by walking the scenarios in Gray-code order.
+
+  Consecutive Gray codes differ by one switched tree, so each step only
+  rescores the game that flipped and the games above it that it feeds,
+  instead of the whole bracket. Row n of the result is the scenario
+  whose bit i is set when tree i is switched (the `generate_paths` order).
+  """
+  base = ArrayBracket.from_tree(hypo_bracket, teams=teams)
+  slots, _ = get_scenario_slots(hypo_bracket, depth)
+  if weights is None:
+    weights = get_game_weights(base.num_games)
+  weights = get_weight_table(weights, len(teams))
+
+  winners = base.winners.tolist()
+  picks_by_game = np.ascontiguousarray(picks.T)
+
+  scores = (picks == base.games) @ weights[np.arange(base.num_games), base.games]
+  table = np.empty((2 ** len(slots), len(picks)), dtype=scores.dtype)
+  table[0] = scores
+
+  for n in range(1, len(table)):
+    # The bit that flips between Gray codes n - 1 and n.
+    slot = slots[(n & -n).bit_length() - 1]
+    old = winners[slot]
+    new = winners[2 * slot + 2] if old == winners[2 * slot + 1] else winners[2 * slot + 1]
+
+    # Walk up while the flipped team had been advancing.
+    while True:
+      winners[slot] = new
+      scores += weights[slot, new] * (picks_by_game[slot] == new)
+      scores -= weights[slot, old] * (picks_by_game[slot] == old)
+      slot = (slot - 1) // 2
+      if slot < 0 or winners[slot] != old:
+        break
+
+    table[n ^ (n >> 1)] = scores
+
+  return table
+
+
+def get_ranks(scores):
+  """Finishing position of every entry in every scenario (1 = first).
+
+  Entries with the same score share the better position, eg scores of
+  [10, 30, 30] rank as [3, 1, 1].
+  """
+  num_entries = scores.shape[1]
+  if scores.size and scores.max() - scores.min() < 8 * num_entries and np.array_equal(scores, np.rint(scores)):
+    return get_ranks_by_count(scores)
+
+  order = np.argsort(-scores, axis=1, kind='stable')
+  ordered = np.take_along_axis(scores, order, axis=1)
+
+  is_new = np.ones(ordered.shape, dtype=bool)
+  is_new[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+  first = np.maximum.accumulate(np.where(is_new, np.arange(num_entries), 0), axis=1)
+
+  ranks = np.empty(scores.shape, dtype=np.min_scalar_type(num_entries))
+  np.put_along_axis(ranks, order, first + 1, axis=1)
+  return ranks
+
+
+def get_ranks_by_count(scores):
+  """Same as `get_ranks`, for integer scores spanning a small range.
+
+  An entry's position is one more than the number of entries that
+  scored higher, which a histogram of each row's scores gives directly,
+  without sorting every row.
+  """
+  num_scenarios, num_entries = scores.shape
+  lo = scores.min()
+  values = (scores - lo).astype(np.intp)
+  num_values = int(values.max()) + 1
+
+  offsets = np.arange(num_scenarios)[:, None] * num_values
+  counts = np.bincount((values + offsets).ravel(), minlength=num_scenarios * num_values)
+  counts = counts.reshape(num_scenarios, num_values)
+  higher = np.cumsum(counts[:, ::-1], axis=1)[:, ::-1] - counts
+
+  ranks = np.take_along_axis(higher, values, axis=1) + 1
+  return ranks.astype(np.min_scalar_type(num_entries))
@@ -0,0 +1,218 @@
+"""bracket.py
+
+A compact, array-backed alternative to MatchupTree for fast scoring.
+"""
+import functools
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from matchup import MatchupTree
+
+
+class TeamRegistry:
+  """Interns team names as small integer IDs shared between brackets."""
+
+  def __init__(self, names=()):
+    self.names = []
+    self.ids = {}
+    for name in names:
+      self.intern(name)
+
+  def intern(self, name):
+    """Return the ID for `name`, registering it if it is new."""
+    team_id = self.ids.get(name)
+    if team_id is None:
+      team_id = len(self.names)
+      self.ids[name] = team_id
+      self.names.append(name)
+    return team_id
+
+  def name(self, team_id):
+    return self.names[team_id]
+
+  def __contains__(self, name):
+    return name in self.ids
+
+  def __len__(self):
+    return len(self.names)
+
+
+# Every bracket shares this registry unless told otherwise, so team IDs
+# can be compared directly between brackets.
+TEAMS = TeamRegistry()
+
+
+def get_heap_nodes(tree):
+  """Return every node of `tree` (subtrees and team names) in heap order.
+
+  The two children of each game are put in a canonical order, by the
+  alphabetically-first team in each subtree (same rule as
+  `util.get_sorted_clean_elem`), so that a given heap slot refers to the
+  same game in every bracket that shares a base.
+  """
+  first_names = {}
+
+  def first_name(node):
+    if isinstance(node, str):
+      return node
+    if id(node) not in first_names:
+      first_names[id(node)] = min(first_name(node.winner), first_name(node.loser))
+    return first_names[id(node)]
+
+  nodes = [tree]
+  level = [tree]
+  while isinstance(level[0], MatchupTree):
+    if not all(isinstance(node, MatchupTree) for node in level):
+      raise ValueError('Only full brackets (no play-in games) can be stored as arrays.')
+    level = [
+      child
+      for node in level
+      for child in sorted([node.winner, node.loser], key=first_name)
+    ]
+    nodes.extend(level)
+
+  return nodes
+
+
+@functools.lru_cache()
+def get_game_weights(num_games, points_per_round=320):
+  """Points for each game slot of a heap-ordered bracket (read-only)."""
+  weights = np.empty(num_games)
+  for depth in range(num_games.bit_length()):
+    lo, hi = 2 ** depth - 1, 2 ** (depth + 1) - 1
+    weights[lo:hi] = points_per_round / (hi - lo)
+  weights.flags.writeable = False
+  return weights
+
+
+class ArrayBracket:
+  """Bracket stored as a flat heap-ordered array of interned team IDs.
+
+  Node i has children 2i + 1 and 2i + 2. The first `num_games` entries
+  of `winners` hold the winner of each game (the root is the national
+  championship), and the remaining entries are the teams in the leaves.
+  """
+
+  def __init__(self, winners, teams=TEAMS):
+    winners = np.asarray(winners, dtype=np.int16)
+    if winners.ndim != 1 or (len(winners) + 1) & len(winners) != 0:
+      raise ValueError('`winners` must be a heap-ordered array for a full bracket.')
+
+    self.winners = winners
+    self.teams = teams
+
+  @property
+  def num_games(self):
+    return len(self.winners) // 2
+
+  @property
+  def depth(self):
+    """Same meaning as MatchupTree.depth."""
+    return self.num_games.bit_length() - 1
+
+  @property
+  def games(self):
+    """Winner IDs of every game, in heap order."""
+    return self.winners[:self.num_games]
+
+  @property
+  def winner_name(self):
+    return self.teams.name(self.winners[0])
+
+  def get_names_by_depth(self, depth):
+    """Like MatchupTree.get_names_by_depth, but in canonical order."""
+    lo, hi = 2 ** depth - 1, 2 ** (depth + 1) - 1
+    return [self.teams.name(team_id) for team_id in self.winners[lo:hi]]
+
+  def score(self, actual, rules=None):
+    """Score this bracket against another representing the actual results.
+
+    rules (scoring.ScoringRules): defaults to 320 points per round.
+    """
+    if rules is not None:
+      return rules.score(self, actual)
+    matches = self.games == actual.games
+    return float(get_game_weights(self.num_games) @ matches)
+
+  def score_by_depth(self, actual, depth, rules=None):
+    if rules is not None:
+      return rules.score_by_depth(self, actual, depth)
+
+    points_per_round = 320  # accept as input
+
+    lo, hi = 2 ** depth - 1, 2 ** (depth + 1) - 1
+    points_per_game = points_per_round / (hi - lo)
+
+    return points_per_game * np.count_nonzero(self.winners[lo:hi] == actual.winners[lo:hi])
+
+  def copy(self):
+    return type(self)(self.winners.copy(), teams=self.teams)
+
+  @classmethod
+  def from_tree(cls, tree, teams=TEAMS):
+    winners = [
+      teams.intern(node if isinstance(node, str) else node.winner_name)
+      for node in get_heap_nodes(tree)
+    ]
+    return cls(winners, teams=teams)
+
+  @classmethod
+  def from_dict(cls, d, teams=TEAMS):
+    return cls.from_tree(MatchupTree.from_dict(d), teams=teams)
+
+  @classmethod
+  def from_xml(cls, x, teams=TEAMS):
+    """Expects ET.Element"""
+    return cls.from_tree(MatchupTree.from_xml(x), teams=teams)
+
+  def to_tree(self):
+    nodes = [None] * self.num_games + [self.teams.name(t) for t in self.winners[self.num_games:]]
+    for i in reversed(range(self.num_games)):
+      left, right = nodes[2 * i + 1], nodes[2 * i + 2]
+      if self.winners[i] == self.winners[2 * i + 1]:
+        nodes[i] = MatchupTree(left, right)
+      elif self.winners[i] == self.winners[2 * i + 2]:
+        nodes[i] = MatchupTree(right, left)
+      else:
+        raise ValueError(f'Winner of game {i} did not play in it.')
+
+    return nodes[0]
+
+  def to_dict(self):
+    return self.to_tree().to_dict()
+
+  def to_xml(self):
+    return self.to_tree().to_xml()
+
+  def __repr__(self):
+    return f'ArrayBracket({self.winner_name}, depth={self.depth})'
+
+
+def read_xml_file(path, teams=TEAMS):
+  return ArrayBracket.from_xml(ET.parse(path).getroot(), teams=teams)
+
+
+if __name__ == '__main__':  # debug time
+  import glob
+  import timeit
+
+  from scenarios import read_xml_file as read_tree_file
+
+  actual_tree = read_tree_file('data/sweet_sixteen.xml')
+  actual = ArrayBracket.from_tree(actual_tree)
+
+  # Scores should match the MatchupTree versions exactly.
+  for fname in sorted(glob.glob('data/*.xml')):
+    tree = read_tree_file(fname)
+    bracket = ArrayBracket.from_tree(tree)
+    assert bracket.score(actual) == tree.score(actual_tree), fname
+    assert all(
+      bracket.score_by_depth(actual, i) == tree.score_by_depth(actual_tree, i)
+      for i in range(tree.depth + 1)
+    ), fname
+    assert ET.tostring(bracket.to_xml()) == ET.tostring(tree.to_xml()), fname
+    print(f'{fname}: {bracket.score(actual)}')
+
+  print(timeit.timeit(lambda: tree.score(actual_tree), number=1000), 'ms per tree score')
+  print(timeit.timeit(lambda: bracket.score(actual), number=1000), 'ms per array score')
@@ -0,0 +1,216 @@
+"""collapse.py
+
+Merge scenarios that no entry in the pool can tell apart.
+
+If nobody picked a team to win a game, or any game after it, then it
+makes no difference to anyone whether that team wins there or the team
+it beat does. More generally, two ways of playing out part of the
+bracket are interchangeable when they give every entry the same points
+and send a team up that matters to the same games above.
+
+So, working up the remaining games, keep one representative for each
+(points for every entry, team going up) pair, and count how many
+scenarios it stands for. A team nobody picked any further is just
+"someone". What comes out the top is one representative scenario per
+distinct score vector, with its multiplicity, which can be a tiny
+fraction of the 2 ** trees scenarios.
+
+Each game's classes come from every class on one side against every
+class on the other, so the work grows with the product of the two sides'
+class counts. Points are packed into int64 words so that product is one
+addition per row, and merging is one sort.
+"""
+import numpy as np
+
+import batch
+from bracket import TEAMS, ArrayBracket, get_game_weights
+
+
+# Label for a team going up that nobody picked in any game further up.
+NOBODY = -1
+
+
+def masks_to_switches(masks, num_trees):
+  """Like `batch.masks_to_switches`, for Python int masks of any width."""
+  num_bytes = (num_trees + 7) // 8
+  data = b''.join(mask.to_bytes(num_bytes, 'little') for mask in masks)
+  bits = np.frombuffer(data, dtype=np.uint8).reshape(len(masks), num_bytes)
+  return np.unpackbits(bits, axis=1, count=num_trees, bitorder='little').astype(bool)
+
+
+class PointKeys:
+  """Every entry's points, packed into as few int64 words as they fit in.
+
+  Each entry gets enough bits for the most points the remaining games can
+  give, so adding two keys adds every entry's points with no carries. The
+  last field holds the team going up while merging. Points that aren't
+  whole multiples of one unit are kept as floats instead.
+  """
+
+  def __init__(self, weights, slots, num_entries, num_teams):
+    self.unit = None
+    if np.array_equal(weights, np.rint(weights)):
+      self.unit = max(1, int(np.gcd.reduce(np.rint(weights).astype(np.int64), axis=None)))
+      width = int(weights[slots].max(axis=1).sum() // self.unit).bit_length()
+      self.words, self.shifts = get_layout([width] * num_entries + [num_teams.bit_length()])
+
+  def pack(self, points):
+    """(rows x entries) points -> (rows x words) keys."""
+    if self.unit is None:
+      return np.asarray(points, dtype=np.float64)
+    units = np.rint(points / self.unit).astype(np.int64)
+    keys = np.zeros((len(points), self.words[-1] + 1), dtype=np.int64)
+    for word in range(keys.shape[1]):
+      fields = np.flatnonzero(self.words[:-1] == word)
+      keys[:, word] = (units[:, fields] << self.shifts[fields]).sum(axis=1)
+    return keys
+
+  def merge(self, points, teams, masks, counts):
+    """Merge classes with the same points and team going up, adding up their counts."""
+    if self.unit is None:
+      rows = np.column_stack([points, teams])
+    else:
+      rows = points.copy()
+      rows[:, self.words[-1]] += (teams.astype(np.int64) + 1) << self.shifts[-1]
+
+    order = np.argsort(rows[:, 0]) if rows.shape[1] == 1 else np.lexsort(rows.T[::-1])
+    rows = rows[order]
+    is_first = np.ones(len(rows), dtype=bool)
+    is_first[1:] = (rows[1:] != rows[:-1]).any(axis=1)
+    starts = np.flatnonzero(is_first)
+    first = order[starts]
+    return points[first], teams[first], masks[first], np.add.reduceat(counts[order], starts)
+
+
+def get_layout(widths):
+  """Word and bit offset of fields `widths` bits wide, filling words up to 63 bits."""
+  words, shifts = [], []
+  word = used = 0
+  for width in widths:
+    if used + width > 63:
+      word, used = word + 1, 0
+    words.append(word)
+    shifts.append(used)
+    used += width
+  return np.array(words), np.array(shifts, dtype=np.int64)
+
+
+def get_scenario_classes(hypo_bracket, picks, depth=3, weights=None, block_size=2 ** 20, teams=TEAMS):
+  """One representative scenario for each distinct score vector, and how many scenarios share it.
+
+  picks (array): (entries x games) picks, eg from `batch.get_pick_matrix`.
+  weights: per-game or per-game, per-team points (see
+    `batch.get_weight_table`). Defaults to 320 points per round.
+  block_size (int): rows of a game's class cross product built at once.
+
+  Returns (masks, counts): representative scenario masks (same bits as
+  `scenarios.iter_masks`, as Python ints) and the number of scenarios
+  each one stands for. The counts add up to 2 ** trees.
+  """
+  base = ArrayBracket.from_tree(hypo_bracket, teams=teams)
+  slots, sides = batch.get_scenario_slots(hypo_bracket, depth)
+  if weights is None:
+    weights = get_game_weights(base.num_games)
+  weights = batch.get_weight_table(weights, len(teams))
+  picks_by_game = np.asarray(picks).T
+  num_entries = len(picks_by_game[0])
+  tree_by_slot = {slot: i for i, slot in enumerate(slots.tolist())}
+  # Masks stay NumPy ints up to the round of 64 (63 trees).
+  mask_dtype = np.uint64 if len(slots) <= 64 else object
+  keys = PointKeys(weights, slots, num_entries, len(teams))
+
+  # Teams someone picked in a game after each node (strictly above it).
+  picked_above = [frozenset()]
+  for node in range(1, 2 * len(slots) + 1):
+    parent = (node - 1) // 2
+    picked_above.append(picked_above[parent] | set(picks_by_game[parent].tolist()))
+
+  def label(teams, node):
+    return np.where(np.isin(teams, list(picked_above[node])), teams, NOBODY)
+
+  # For every remaining game: (points keys, team going up, mask, count),
+  # one row per class.
+  options = {}
+
+  def get_options(node):
+    if node in options:
+      return options.pop(node)
+    points = keys.pack(np.zeros((1, num_entries)))
+    return points, label(base.winners[node:node + 1], node), np.zeros(1, dtype=mask_dtype), np.ones(1, dtype=np.uint64)
+
+  for slot in reversed(range(len(slots))):
+    tree = tree_by_slot[slot]
+    children = [get_options(2 * slot + 1), get_options(2 * slot + 2)]
+
+    parts = []
+    for side in (0, 1):
+      points, teams, masks, counts = children[side]
+      points = points + keys.pack(weights[slot, teams][:, None] * (teams[:, None] == picks_by_game[slot]))
+      points, teams, masks, counts = keys.merge(points, label(teams, slot), masks, counts)
+
+      # Whoever comes up the other side is out, so only its points matter.
+      points_other, teams_other, masks_other, counts_other = children[1 - side]
+      points_other, _, masks_other, counts_other = keys.merge(
+        points_other, np.full_like(teams_other, NOBODY), masks_other, counts_other,
+      )
+      switched = mask_dtype(int((side == 1) != sides[tree]) << tree)
+
+      # Every class on this side against every class on the other, a
+      # block at a time so the whole cross product is never in memory.
+      step = max(1, block_size // len(counts_other))
+      for start in range(0, len(counts), step):
+        block = slice(start, start + step)
+        parts.append(keys.merge(
+          (points[block, None] + points_other[None]).reshape(-1, points.shape[1]),
+          np.repeat(teams[block], len(counts_other)),
+          (masks[block, None] | masks_other[None] | switched).ravel(),
+          np.outer(counts[block], counts_other).ravel(),
+        ))
+        if sum(len(part[3]) for part in parts) > 2 * block_size:
+          parts = [keys.merge(*(np.concatenate(arrays) for arrays in zip(*parts)))]
+
+    options[slot] = keys.merge(*(np.concatenate(arrays) for arrays in zip(*parts)))
+
+  _, _, masks, counts = options[0]
+  return [int(mask) for mask in masks], counts
+
+
+def get_class_score_table(hypo_bracket, picks, depth=3, weights=None, teams=TEAMS):
+  """Score table over the scenario classes only.
+
+  Returns (masks, counts, scores): see `get_scenario_classes`; scores is
+  (classes x entries), same as `batch.get_score_table` on the masks.
+  """
+  masks, counts = get_scenario_classes(hypo_bracket, picks, depth, weights, teams=teams)
+  switches = masks_to_switches(masks, 2 ** (depth + 1) - 1)
+  outcomes = batch.get_outcome_matrix(hypo_bracket, switches, depth, teams=teams)
+  return masks, counts, batch.get_score_table(outcomes, picks, weights)
+
+
+def iter_class_outcomes(hypo_bracket, picks, depth=3, weights=None, chunk_size=2 ** 16, teams=TEAMS):
+  """Yield (outcomes, counts) for the scenario classes, a chunk at a time.
+
+  outcomes is a (classes x games) winner matrix like
+  `batch.get_outcome_matrix`, counts how many scenarios each row stands for.
+  """
+  masks, counts = get_scenario_classes(hypo_bracket, picks, depth, weights, teams=teams)
+  base = ArrayBracket.from_tree(hypo_bracket, teams=teams)
+  slots, sides = batch.get_scenario_slots(hypo_bracket, depth)
+  for start in range(0, len(masks), chunk_size):
+    switches = masks_to_switches(masks[start:start + chunk_size], len(slots))
+    yield batch.resolve_outcomes(base, slots, sides, switches), counts[start:start + chunk_size]
+
+
+if __name__ == '__main__':  # debug time
+  import time
+
+  import scenarios
+
+  brackets = scenarios.load_brackets()
+  picks = batch.get_pick_matrix(brackets.values())
+  for depth in range(4):
+    hypo = scenarios.sweet_sixteen
+    t0 = time.time()
+    masks, counts = get_scenario_classes(hypo, picks, depth)
+    print(f'depth {depth}: {2 ** scenarios.get_num_trees(depth)} scenarios -> {len(masks)} classes '
+          f'in {1000 * (time.time() - t0):.1f} ms')
@@ -0,0 +1,288 @@
+"""elimination.py
+
+Figure out which entries can still finish first (or top k) without
+scoring every scenario.
+
+Branch and bound over the remaining games, deciding one game at a time.
+At each step, bound how far the entry in question could finish ahead of
+every other entry given the games decided so far. Once k other entries
+are guaranteed to finish above it, nothing below that point needs to be
+looked at.
+
+The bound on each rival is a DP over the undecided games. Deciding a
+game only changes the DP at that game and the games above it, so the
+rest is kept from the step before. A second pass down the bracket gives
+the same bound with each undecided game going either way: a way that
+would leave k rivals out of reach is ruled out on the spot, and the game
+decided next is the one whose outcome swings the closest rivals'
+margins the most.
+
+The closest rivals are also bounded together: for the entry to finish
+above all of them, it has to finish above any weighted average of them,
+which is one more DP. Reweighting towards whoever beats the entry in
+that DP's best scenario catches entries that can top any one rival but
+never all of them at once, and each of those scenarios is checked as a
+witness along the way.
+"""
+import numpy as np
+
+import batch
+from bracket import TEAMS, ArrayBracket
+
+
+class EliminationSearch:
+  def __init__(self, hypo_bracket, brackets, depth=3, num_close=16, num_rounds=4, rules=None, teams=TEAMS):
+    """
+    hypo_bracket (MatchupTree): the actual results so far. The trees in
+      `hypo_bracket.get_every_tree(depth)` are the games still to be played.
+    brackets (dict): MatchupTree or ArrayBracket entries by name.
+    num_close (int): how many of the closest rivals get bounded together.
+    num_rounds (int): rounds of reweighting them per step, at least one.
+    rules (scoring.ScoringRules): defaults to 320 points per round.
+    """
+    self.names = list(brackets)
+    self.num_close = num_close
+    self.num_rounds = max(1, num_rounds)
+    self.base = ArrayBracket.from_tree(hypo_bracket, teams=teams)
+    self.slots, self.sides = batch.get_scenario_slots(hypo_bracket, depth)
+    self.picks = batch.get_pick_matrix(brackets.values(), teams=teams)
+    self.picks_by_game = np.ascontiguousarray(self.picks.T)
+    # (games x teams) points for a correct pick.
+    self.weights = batch.get_weight_table(batch.get_weights(self.base, rules), len(teams))
+    self.num_teams = len(teams)
+
+    final = np.ones(self.base.num_games, dtype=bool)
+    final[self.slots] = False
+    self.scores_final = (self.picks[:, final] == self.base.games[final]) @ self.weights[final, self.base.games[final]]
+
+    # Bottom-up order for the DPs.
+    self.order = sorted(self.slots.tolist(), reverse=True)
+
+  def get_children(self, slot, options, num_columns):
+    """(teams, gains) for both sides of a game: DP options, or the team already there."""
+    return [
+      options[child] if child in options else (self.base.winners[child:child + 1], np.zeros((1, num_columns)))
+      for child in (2 * slot + 1, 2 * slot + 2)
+    ]
+
+  def get_gains(self, entry, slot, teams):
+    """What `entry` gains on every entry if each of `teams` wins the game at `slot`."""
+    points = self.weights[slot, teams][:, None] * (teams[:, None] == self.picks_by_game[slot])
+    return points[:, [entry]] - points
+
+  def update_options(self, entry, decided, options, slot=None):
+    """Margin DP for `slot` and every game above it, the ones deciding it changes.
+
+    decided (dict): {slot: side} for games whose winner is known to come
+      from the first (0) or second (1) of its children in heap order.
+    options (dict): {slot: (teams, gains)} from the step before, or empty
+      to run the whole DP, where gains[i, r] is the most `entry` can gain
+      on entry r at and below the game if teams[i] wins it. Returns a new
+      dict; `options` isn't changed.
+    """
+    options = dict(options)
+    if slot is None:
+      todo = self.order
+    else:
+      todo = [slot]
+      while slot > 0:
+        slot = (slot - 1) // 2
+        todo.append(slot)
+
+    for slot in todo:
+      children = self.get_children(slot, options, len(self.names))
+      parts = []
+      for side in (0, 1):
+        if decided.get(slot, side) != side:
+          continue
+        teams, gains = children[side]
+        gains = gains + children[1 - side][1].max(axis=0) + self.get_gains(entry, slot, teams)
+        parts.append((teams, gains))
+      options[slot] = tuple(np.concatenate(arrays) for arrays in zip(*parts))
+    return options
+
+  def get_margins(self, entry, options):
+    """Best possible lead of `entry` over every entry, given the DP options.
+
+    A negative margin means that entry finishes above `entry` no matter
+    how the undecided games go.
+    """
+    return self.scores_final[entry] - self.scores_final + options[0][1].max(axis=0)
+
+  def get_side_margins(self, entry, decided, options):
+    """Best possible lead of `entry` over every entry with each undecided game going each way.
+
+    Walks down the bracket keeping, for every team that could come up to
+    a game, the most `entry` can gain above that game.
+
+    Returns {slot: (2 x entries) margins} for the undecided games.
+    """
+    base_margins = self.scores_final[entry] - self.scores_final
+    outside = {0: np.zeros(options[0][1].shape)}
+    side_margins = {}
+    for slot in reversed(self.order):
+      children = self.get_children(slot, options, len(self.names))
+      above = outside.pop(slot)
+
+      # {side: (gains below, gains here and above)} for each team on
+      # that side winning here, lined up with `above`.
+      wins = {}
+      start = 0
+      for side in (0, 1):
+        if decided.get(slot, side) != side:
+          continue
+        teams, gains = children[side]
+        gains_here = children[1 - side][1].max(axis=0) + self.get_gains(entry, slot, teams)
+        wins[side] = gains, gains_here + above[start:start + len(teams)]
+        start += len(teams)
+      if slot not in decided:
+        side_margins[slot] = base_margins + np.stack([sum(wins[side]).max(axis=0) for side in (0, 1)])
+
+      for side in (0, 1):
+        child = 2 * slot + 1 + side
+        if child not in options:
+          continue
+        parts = []
+        if side in wins:
+          parts.append(wins[side][1])
+        if 1 - side in wins:
+          # Whoever comes up this side loses here to the other side's best.
+          beaten = (sum(wins[1 - side]) - children[side][1].max(axis=0)).max(axis=0)
+          parts.append(np.broadcast_to(beaten, children[side][1].shape))
+        outside[child] = np.maximum.reduce(parts)
+
+    return side_margins
+
+  def get_joint_scenario(self, entry, rivals, rival_weights, decided):
+    """Most `entry` can outscore a weighted average of `rivals` by, and the winners of a scenario that gets it.
+
+    rival_weights (array): non-negative, adding up to 1. A negative lead
+      means that in every scenario at least one of the rivals finishes
+      above `entry`.
+    """
+    options = {}
+    for slot in self.order:
+      counts = np.bincount(self.picks_by_game[slot, rivals], weights=rival_weights, minlength=self.num_teams)
+      children = self.get_children(slot, options, 1)
+      parts = []
+      for side in (0, 1):
+        if decided.get(slot, side) != side:
+          continue
+        teams, gains = children[side]
+        picked = (teams == self.picks_by_game[slot, entry]) - counts[teams]
+        parts.append((teams, gains + children[1 - side][1].max() + (self.weights[slot, teams] * picked)[:, None]))
+      options[slot] = tuple(np.concatenate(arrays) for arrays in zip(*parts))
+
+    # Walk back down: the chosen team came up from one side, and the
+    # other side's best team is the one that loses to it.
+    winners = self.base.winners.copy()
+    teams, gains = options[0]
+    lead = self.scores_final[entry] - rival_weights @ self.scores_final[rivals] + gains.max()
+    winners[0] = teams[gains.argmax()]
+    for slot in reversed(self.order):
+      for child in (2 * slot + 1, 2 * slot + 2):
+        if child in options:
+          teams, gains = options[child]
+          winners[child] = winners[slot] if winners[slot] in teams else teams[gains.argmax()]
+    return lead, winners
+
+  def get_scores(self, winners):
+    """Every entry's score in the scenario where the remaining games go to `winners`."""
+    correct = self.picks_by_game[self.slots] == winners[self.slots, None]
+    return self.scores_final + correct.T @ self.weights[self.slots, winners[self.slots]]
+
+  def to_mask(self, winners):
+    """Convert the remaining games' winners into a scenario mask for the hypo bracket's trees."""
+    mask = 0
+    for i, slot in enumerate(self.slots):
+      if (winners[slot] == winners[2 * slot + 2]) != self.sides[i]:
+        mask |= 1 << i
+    return mask
+
+  def find_witness(self, name, k=1):
+    """Return a scenario mask where `name` finishes in the top k, or None.
+
+    Ties count in the entry's favor: it only needs fewer than k entries
+    strictly above it.
+    """
+    entry = self.names.index(name)
+
+    def search(decided, options):
+      # Rule out every way a game could go that leaves k rivals out of
+      # reach, until there's nothing left to rule out.
+      while True:
+        margins = self.get_margins(entry, options)
+        above = np.count_nonzero(margins < 0)
+        if above >= k:
+          return None
+        if len(decided) == len(self.order):
+          return self.get_joint_scenario(entry, [], np.empty(0), decided)[1]
+
+        side_margins = self.get_side_margins(entry, decided, options)
+        forced = {}
+        for slot, slot_margins in side_margins.items():
+          blocked = np.count_nonzero(slot_margins < 0, axis=1) >= k
+          if blocked.all():
+            return None
+          if blocked.any():
+            forced[slot] = int(blocked[0])
+        if not forced:
+          break
+
+        decided = {**decided, **forced}
+        for slot in sorted(forced, reverse=True):
+          options = self.update_options(entry, decided, options, slot)
+
+      # Closest rivals, not counting the ones already guaranteed above.
+      close = np.argsort(margins, kind='stable')[above:above + self.num_close + 1]
+      close = close[close != entry][:self.num_close]
+
+      # Bound them together, shifting weight onto whoever finishes above
+      # the entry in each round's best scenario (multiplicative weights).
+      rival_weights = np.full(len(close), 1 / max(1, len(close)))
+      for _ in range(self.num_rounds):
+        lead, winners = self.get_joint_scenario(entry, close, rival_weights, decided)
+        scores = self.get_scores(winners)
+        if np.count_nonzero(scores > scores[entry]) < k:
+          return winners
+        if above < k - 1:
+          break
+        if lead < -1e-6:
+          # No room for one more above, and one of them always is.
+          return None
+        behind = scores[close] - scores[entry]
+        rival_weights = rival_weights * np.exp(behind / max(1, np.abs(behind).max()))
+        rival_weights /= rival_weights.sum()
+
+      # Decide the game whose outcome swings the close rivals' margins
+      # the most, the way the last joint scenario has it first.
+      undecided = list(side_margins)
+      swings = np.stack([side_margins[slot][:, close] for slot in undecided])
+      swing = np.minimum(np.abs(swings[:, 0] - swings[:, 1]), margins[close] + 1).sum(axis=1)
+      slot = undecided[int(np.argmax(swing))]
+      first = int(winners[slot] == winners[2 * slot + 2])
+
+      for side in (first, 1 - first):
+        new_decided = {**decided, slot: side}
+        found = search(new_decided, self.update_options(entry, new_decided, options, slot))
+        if found is not None:
+          return found
+
+      return None
+
+    winners = search({}, self.update_options(entry, {}, {}))
+    return None if winners is None else self.to_mask(winners)
+
+
+def elimination_report(hypo_bracket, brackets, depth=3, k=1, rules=None):
+  """{name: scenario mask where the entry finishes top k, or None if eliminated}"""
+  search = EliminationSearch(hypo_bracket, brackets, depth, rules=rules)
+  return {name: search.find_witness(name, k) for name in search.names}
+
+
+if __name__ == '__main__':  # debug time
+  import scenarios
+
+  brackets = scenarios.load_brackets()
+  for name, mask in elimination_report(scenarios.sweet_sixteen, brackets).items():
+    print(f'{name}: {"eliminated" if mask is None else scenarios.mask_to_path(mask, scenarios.get_num_trees())}')
@@ -0,0 +1,268 @@
+"""fetcher.py
+
+Scrape a whole pool of entries concurrently.
+
+Pages are fetched with asyncio on top of one pooled requests.Session,
+with a cap on requests in flight, a token-bucket rate limit, and
+retries with exponential backoff. Each bracket is handed off (eg
+appended to a pool file) as soon as it's parsed.
+
+With a PageCache, pages are revalidated with conditional requests, and
+offline mode replays them from the cache without touching the network.
+
+Requests run on their own thread pool, one thread per request allowed in
+flight, and parsing on another, so neither the default executor's size
+nor a backlog of pages to parse limits how many requests are out.
+
+`serve_pages` stands in for ESPN locally, serving saved entry pages by
+entryID.
+"""
+import asyncio
+import concurrent.futures
+import hashlib
+import http.server
+import os
+import random
+import time
+import urllib.parse
+
+import requests
+import requests.adapters
+
+import scraper
+from pool import PoolFile
+
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+  """Allow `rate` requests per second on average, in bursts of up to `capacity`."""
+
+  def __init__(self, rate, capacity=None):
+    self.rate = rate
+    self.capacity = capacity if capacity is not None else max(1, rate)
+    self.tokens = self.capacity
+    self.updated = time.monotonic()
+    self.lock = asyncio.Lock()
+
+  async def acquire(self):
+    async with self.lock:
+      while True:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+          self.tokens -= 1
+          return
+        await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class FetchError(Exception):
+  pass
+
+
+def make_session(concurrency):
+  session = requests.Session()
+  adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+  session.mount('http://', adapter)
+  session.mount('https://', adapter)
+  return session
+
+
+class Fetcher:
+  def __init__(self, base_url=scraper.BASE_URL, concurrency=16, rate=10, retries=4,
+               backoff=0.5, timeout=10, cache=None, offline=False, parse_workers=None):
+    """
+    concurrency (int): max requests in flight.
+    rate (float): max requests started per second.
+    retries (int): extra attempts after a failed request.
+    backoff (float): seconds to wait before the first retry, doubled each time.
+    cache (PageCache): where to keep raw pages.
+    offline (bool): only replay pages from `cache`.
+    parse_workers (int): threads parsing pages. Defaults to the CPU count.
+    """
+    if offline and cache is None:
+      raise ValueError('Offline mode needs a cache.')
+
+    self.base_url = base_url
+    self.concurrency = concurrency
+    self.bucket = TokenBucket(rate)
+    self.retries = retries
+    self.backoff = backoff
+    self.timeout = timeout
+    self.session = make_session(concurrency)
+    self.fetch_executor = concurrent.futures.ThreadPoolExecutor(concurrency, thread_name_prefix='fetch')
+    self.parse_executor = concurrent.futures.ThreadPoolExecutor(parse_workers, thread_name_prefix='parse')
+    self.cache = cache
+    self.offline = offline
+
+  def get(self, entry_id, headers=None):
+    """Blocking GET of one entry page. Returns the response."""
+    url = scraper.get_entry_url(entry_id, self.base_url)
+    return self.session.get(url, headers=headers, timeout=self.timeout)
+
+  async def fetch_page(self, entry_id):
+    """Raw HTML of one entry page, retrying transient failures."""
+    headers = {}
+    if self.cache is not None:
+      if self.offline:
+        content = self.cache.get(entry_id)
+        if content is None:
+          raise FetchError(f'Entry {entry_id} is not in the cache')
+        return content
+      headers = self.cache.get_validators(entry_id)
+
+    for attempt in range(self.retries + 1):
+      await self.bucket.acquire()
+      try:
+        loop = asyncio.get_running_loop()
+        response = await loop.run_in_executor(self.fetch_executor, self.get, entry_id, headers)
+      except requests.RequestException as e:
+        error = e
+      else:
+        if response.status_code == 304 and headers:
+          self.cache.revalidated(entry_id)
+          return self.cache.get(entry_id)
+        if response.status_code == 200:
+          if self.cache is not None:
+            self.cache.put(
+              entry_id,
+              response.content,
+              etag=response.headers.get('ETag'),
+              last_modified=response.headers.get('Last-Modified'),
+            )
+          return response.content
+        error = FetchError(f'HTTP {response.status_code} for entry {entry_id}')
+        if response.status_code not in RETRY_STATUSES:
+          raise error
+
+      if attempt < self.retries:
+        await asyncio.sleep(self.backoff * 2 ** attempt * (1 + random.random()))
+
+    raise FetchError(f'Gave up on entry {entry_id}') from error
+
+  async def fetch_brackets(self, entry_ids, on_bracket):
+    """Fetch and parse every entry, calling on_bracket(name, bracket) as each one lands.
+
+    entry_ids (dict): entry IDs by name.
+
+    Returns {name: exception} for the entries that failed.
+    """
+    semaphore = asyncio.Semaphore(self.concurrency)
+    errors = {}
+
+    loop = asyncio.get_running_loop()
+
+    async def fetch_one(name, entry_id):
+      try:
+        # Parsing happens after the slot is given up, so pages waiting
+        # to be parsed don't hold back requests.
+        async with semaphore:
+          content = await self.fetch_page(entry_id)
+        bracket = await loop.run_in_executor(self.parse_executor, scraper.parse_bracket, content)
+      except Exception as e:
+        errors[name] = e
+        return
+      on_bracket(name, bracket)
+
+    await asyncio.gather(*[fetch_one(name, entry_id) for name, entry_id in entry_ids.items()])
+    return errors
+
+  def close(self):
+    self.fetch_executor.shutdown()
+    self.parse_executor.shutdown()
+    self.session.close()
+
+
+class SavedPageHandler(http.server.BaseHTTPRequestHandler):
+  """Serve `<directory>/<entryID>.html` for `?entryID=...`, with ETags."""
+
+  def __init__(self, *args, directory, delay=0, **kwargs):
+    self.directory = directory
+    self.delay = delay
+    super().__init__(*args, **kwargs)
+
+  def do_GET(self):
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+    entry_id = query.get('entryID', [''])[0]
+    path = os.path.join(self.directory, f'{entry_id}.html')
+    if not entry_id.isdigit() or not os.path.exists(path):
+      self.send_error(404)
+      return
+
+    time.sleep(self.delay)
+    with open(path, 'rb') as f:
+      body = f.read()
+    etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+    if self.headers.get('If-None-Match') == etag:
+      self.send_response(304)
+      self.send_header('ETag', etag)
+      self.end_headers()
+      return
+
+    self.send_response(200)
+    self.send_header('Content-Type', 'text/html')
+    self.send_header('Content-Length', str(len(body)))
+    self.send_header('ETag', etag)
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+
+def serve_pages(directory, port=8000, delay=0):
+  """Serve saved entry pages (named `<entryID>.html`) on localhost until interrupted.
+
+  delay (float): seconds to hold every response, to stand in for a slow server.
+  Point a Fetcher's base_url at f'http://localhost:{port}/entry'.
+  """
+  def handler(*args, **kwargs):
+    return SavedPageHandler(*args, directory=directory, delay=delay, **kwargs)
+
+  with http.server.ThreadingHTTPServer(('localhost', port), handler) as server:
+    server.serve_forever()
+
+
+def scrape_to_pool(entry_ids, pool_path, **kwargs):
+  """Scrape every entry straight into a pool file (created if need be).
+
+  kwargs are passed on to Fetcher. Returns {name: exception} for the
+  entries that failed.
+  """
+  pool = PoolFile(pool_path) if os.path.exists(pool_path) else None
+
+  def on_bracket(name, bracket):
+    nonlocal pool
+    if pool is None:
+      pool = PoolFile.create(pool_path, bracket)
+    pool.append({name: bracket})
+
+  fetcher = Fetcher(**kwargs)
+  try:
+    return asyncio.run(fetcher.fetch_brackets(entry_ids, on_bracket))
+  finally:
+    fetcher.close()
+
+
+if __name__ == '__main__':  # debug time
+  # Point base_url at a local server (eg `serve_pages` on a directory of
+  # pages saved as <entryID>.html, at http://localhost:8000/entry) to try
+  # this out without hitting ESPN. Pass --offline to re-parse whatever is
+  # already in the page cache.
+  import sys
+
+  from page_cache import PageCache
+
+  offline = '--offline' in sys.argv
+  args = [arg for arg in sys.argv[1:] if arg != '--offline']
+  base_url = args[0] if args else scraper.BASE_URL
+  entry_ids = dict(
+    aar_1 = 54289747,
+    trevor = 59174181,
+    kam_2 = 63359730,
+  )
+  t0 = time.time()
+  errors = scrape_to_pool(entry_ids, 'pool.bin', base_url=base_url, cache=PageCache('page_cache'), offline=offline)
+  print(f'{len(entry_ids) - len(errors)} entries in {time.time() - t0:.1f} s, errors: {errors}')
@@ -0,0 +1,112 @@
+"""headtohead.py
+
+Head-to-head records for every pair of entries across the remaining scenarios.
+
+For every pair (A, B), count the scenarios where A outscores B. That one
+(entries x entries) count matrix gives the rest: B outscoring A is its
+transpose, and ties are whatever's left.
+
+Scenarios are scored a chunk at a time and compared one entry against
+the whole pool per step, so memory stays at one chunk of scores plus
+the count matrix however many entries there are. Scores are squeezed
+into the smallest integer type that holds them first, and each row of
+comparisons is packed into a bitset and popcounted, which together make
+this several times faster than comparing and summing floats.
+"""
+import numpy as np
+
+import batch
+from bracket import TEAMS, ArrayBracket
+
+
+def to_small_ints(scores):
+  """Same ordering as `scores`, as small unsigned ints if they're integers."""
+  if not np.array_equal(scores, np.rint(scores)):
+    return scores
+
+  values = (scores - scores.min()).astype(np.int64)
+  unit = np.gcd.reduce(values, axis=None)
+  if unit > 1:
+    values //= unit
+  return values.astype(np.min_scalar_type(values.max()))
+
+
+def count_bits(flags):
+  """Number of True values in each row of a 2-d bool array."""
+  if not hasattr(np, 'bitwise_count'):  # NumPy < 2.0
+    return np.count_nonzero(flags, axis=1)
+
+  # Pack each row into a bitset, 64 scenarios to a word, and popcount it.
+  packed = np.packbits(flags, axis=1)
+  padding = -packed.shape[1] % 8
+  if padding:
+    packed = np.pad(packed, ((0, 0), (0, padding)))
+  return np.bitwise_count(packed.view(np.uint64)).sum(axis=1, dtype=np.int64)
+
+
+def get_win_counts(hypo_bracket, brackets, depth=3, chunk_size=None, rules=None, teams=TEAMS):
+  """Number of scenarios where each entry outscores each other entry.
+
+  brackets (dict): MatchupTree or ArrayBracket entries by name.
+  chunk_size (int): scenarios scored at once. Defaults to about 2M
+    scores' worth, small enough for a chunk to stay in cache while every
+    entry gets compared against it.
+  rules (scoring.ScoringRules): defaults to 320 points per round.
+
+  Returns (wins, num_scenarios): wins[a, b] is how many scenarios entry
+  a beats entry b in.
+  """
+  base = ArrayBracket.from_tree(hypo_bracket, teams=teams)
+  slots, sides = batch.get_scenario_slots(hypo_bracket, depth)
+  picks = batch.get_pick_matrix(brackets.values(), teams=teams)
+  weights = batch.get_weights(base, rules)
+
+  num_entries = len(picks)
+  num_scenarios = 2 ** len(slots)
+  if chunk_size is None:
+    chunk_size = max(64, 2 ** 21 // num_entries)
+
+  wins = np.zeros((num_entries, num_entries), dtype=np.int64)
+  for _, _, outcomes in batch.iter_outcome_chunks(base, slots, sides, chunk_size):
+    scores = batch.get_score_table(outcomes, picks, weights)
+
+    # Entry-major, so each entry's scores are one contiguous row.
+    scores = np.ascontiguousarray(to_small_ints(scores).T)
+    beaten = np.empty(scores.shape, dtype=bool)
+    for entry in range(num_entries):
+      np.less(scores, scores[entry], out=beaten)
+      wins[entry] += count_bits(beaten)
+
+  return wins, num_scenarios
+
+
+def head_to_head_report(hypo_bracket, brackets=None, depth=3, rules=None):
+  """Fraction of scenarios each entry (rows) beats, ties and loses to each other entry (columns).
+
+  Returns three DataFrames: (wins, ties, losses).
+  """
+  if brackets is None:
+    import scenarios
+    brackets = scenarios.load_brackets()
+
+  wins, num_scenarios = get_win_counts(hypo_bracket, brackets, depth, rules=rules)
+  losses = wins.T
+  ties = num_scenarios - wins - losses
+
+  import pandas as pd
+  names = list(brackets)
+  return tuple(
+    pd.DataFrame(counts / num_scenarios, index=names, columns=names)
+    for counts in (wins, ties, losses)
+  )
+
+
+if __name__ == '__main__':  # debug time
+  import time
+
+  import scenarios
+
+  t0 = time.time()
+  wins, ties, losses = head_to_head_report(scenarios.sweet_sixteen)
+  print(f'{1000 * (time.time() - t0):.1f} ms')
+  print(wins.round(3))
@@ -0,0 +1,308 @@
+"""jobs.py
+
+Long scenario runs that survive crashes and can be split between workers.
+
+A job is a directory holding:
+  manifest.json: entry names, depth, chunk size and chunk count.
+  inputs.pickle: the hypothetical bracket, the pool's brackets and the
+    scoring rules.
+  queue.sqlite: one row per chunk of scenario masks, pending, running
+    or done.
+  chunks/<n>.npy: the scores for chunk n, once it's done.
+
+Any number of processes, on this machine or any other that sees the
+directory, can call `ScenarioJob(path).run()`. Each one claims the next
+pending chunk in a transaction, scores it, writes it out and marks it
+done. A chunk whose worker died is handed out again right away if the
+worker was on this machine, or once its lease runs out if not, so
+resuming is just running again.
+"""
+import json
+import os
+import pickle
+import socket
+import sqlite3
+import time
+
+import numpy as np
+
+import batch
+import store
+from bracket import ArrayBracket
+
+
+class ScenarioJob:
+  def __init__(self, path, lease=600):
+    """Open an existing job.
+
+    lease (float): seconds before a running chunk is given to someone else.
+    """
+    self.path = path
+    self.lease = lease
+    with open(os.path.join(path, 'manifest.json')) as f:
+      self.manifest = json.load(f)
+    self.db = sqlite3.connect(os.path.join(path, 'queue.sqlite'), timeout=60, isolation_level=None)
+    self._inputs = None
+    self._engine = None
+
+  @classmethod
+  def create(cls, path, hypo_bracket, brackets, depth=3, chunk_size=2 ** 16, lease=600, rules=None):
+    """Set up a new job in `path`, split into chunks of `chunk_size` scenarios.
+
+    Refuses (FileExistsError) if `path` already holds a job, and clears out
+    what's left of one whose set up didn't finish.
+
+    rules (scoring.ScoringRules): defaults to 320 points per round.
+    """
+    if rules is not None:
+      weights = batch.get_weights(ArrayBracket.from_tree(hypo_bracket), rules)
+      if not np.array_equal(weights, np.rint(weights)):
+        raise ValueError('Scores can only be stored as integers.')
+
+    slots, _ = batch.get_scenario_slots(hypo_bracket, depth)
+    num_scenarios = 2 ** len(slots)
+    num_chunks = -(-num_scenarios // chunk_size)
+
+    if os.path.exists(os.path.join(path, 'manifest.json')):
+      raise FileExistsError(f'{path} already holds a job.')
+    # No manifest: anything here is from a create that didn't finish, and
+    # no worker can have opened it.
+    for name in ('inputs.pickle', 'queue.sqlite', 'queue.sqlite-journal'):
+      if os.path.exists(os.path.join(path, name)):
+        os.remove(os.path.join(path, name))
+
+    os.makedirs(os.path.join(path, 'chunks'), exist_ok=True)
+    with open(os.path.join(path, 'inputs.pickle'), 'wb') as f:
+      pickle.dump((hypo_bracket, brackets, rules), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    db = sqlite3.connect(os.path.join(path, 'queue.sqlite'))
+    db.execute('''
+      CREATE TABLE IF NOT EXISTS chunks (
+        chunk INTEGER PRIMARY KEY,
+        status TEXT NOT NULL DEFAULT 'pending',
+        worker TEXT,
+        host TEXT,
+        pid INTEGER,
+        claimed_at REAL,
+        finished_at REAL
+      )
+    ''')
+    if db.execute('SELECT COUNT(*) FROM chunks').fetchone()[0]:
+      db.close()
+      raise FileExistsError(f'{path} already has a chunk queue.')
+    db.executemany('INSERT INTO chunks (chunk) VALUES (?)', [(i,) for i in range(num_chunks)])
+    db.commit()
+    db.close()
+
+    # The manifest goes last: a directory without one was never set up.
+    manifest = {
+      'names': list(brackets),
+      'depth': depth,
+      'num_scenarios': num_scenarios,
+      'chunk_size': chunk_size,
+      'num_chunks': num_chunks,
+    }
+    tmp_path = os.path.join(path, 'manifest.json.tmp')
+    with open(tmp_path, 'w') as f:
+      json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(path, 'manifest.json'))
+
+    return cls(path, lease=lease)
+
+  @property
+  def inputs(self):
+    if self._inputs is None:
+      with open(os.path.join(self.path, 'inputs.pickle'), 'rb') as f:
+        self._inputs = pickle.load(f)
+    return self._inputs
+
+  def get_chunk_path(self, chunk):
+    return os.path.join(self.path, 'chunks', f'{chunk:06d}.npy')
+
+  def get_mask_range(self, chunk):
+    start = chunk * self.manifest['chunk_size']
+    return start, min(start + self.manifest['chunk_size'], self.manifest['num_scenarios'])
+
+  def claim(self, worker):
+    """Next chunk for `worker` to score, or None if there's nothing left to hand out."""
+    now = time.time()
+    host = socket.gethostname()
+    self.db.execute('BEGIN IMMEDIATE')
+    try:
+      row = self.db.execute(
+        "SELECT chunk FROM chunks WHERE status = 'pending' "
+        "OR (status = 'running' AND claimed_at < ?) ORDER BY chunk LIMIT 1",
+        (now - self.lease,),
+      ).fetchone()
+      if row is None:
+        # Chunks left running by a process on this machine that's gone.
+        running = self.db.execute(
+          "SELECT chunk, pid FROM chunks WHERE status = 'running' AND host = ? ORDER BY chunk",
+          (host,),
+        ).fetchall()
+        row = next(((chunk,) for chunk, pid in running if not is_alive(pid)), None)
+      if row is not None:
+        self.db.execute(
+          "UPDATE chunks SET status = 'running', worker = ?, host = ?, pid = ?, claimed_at = ? WHERE chunk = ?",
+          (worker, host, os.getpid(), now, row[0]),
+        )
+      self.db.execute('COMMIT')
+    except BaseException:
+      self.db.execute('ROLLBACK')
+      raise
+    return None if row is None else row[0]
+
+  def release(self, chunk):
+    """Put a claimed chunk back up for grabs."""
+    self.db.execute("UPDATE chunks SET status = 'pending', worker = NULL WHERE chunk = ?", (chunk,))
+
+  def complete(self, chunk, scores):
+    """Save a chunk's scores, then mark it done."""
+    chunk_path = self.get_chunk_path(chunk)
+    tmp_path = f'{chunk_path}.tmp.npy'
+    np.save(tmp_path, scores)
+    os.replace(tmp_path, chunk_path)
+    self.db.execute(
+      "UPDATE chunks SET status = 'done', finished_at = ? WHERE chunk = ?",
+      (time.time(), chunk),
+    )
+
+  def get_engine(self):
+    """(base, slots, sides, picks, weights), built once per process."""
+    if self._engine is None:
+      hypo_bracket, brackets, rules = self.inputs
+      base = ArrayBracket.from_tree(hypo_bracket)
+      slots, sides = batch.get_scenario_slots(hypo_bracket, self.manifest['depth'])
+      picks = batch.get_pick_matrix(brackets.values())
+      self._engine = base, slots, sides, picks, batch.get_weights(base, rules)
+    return self._engine
+
+  def score_chunk(self, chunk):
+    base, slots, sides, picks, weights = self.get_engine()
+    start, stop = self.get_mask_range(chunk)
+    _, _, outcomes = next(batch.iter_outcome_chunks(base, slots, sides, stop - start, start, stop))
+    scores = batch.get_score_table(outcomes, picks, weights)
+    max_score = weights.sum() if weights.ndim == 1 else weights.max(axis=1).sum()
+    return scores.astype(np.min_scalar_type(int(max_score)))
+
+  def run(self, worker=None, max_chunks=None, poll=1):
+    """Claim and score chunks until every one is done. Returns how many this worker did.
+
+    While other workers still have chunks running, wait around (checking
+    every `poll` seconds) to take them over if those workers die.
+    """
+    worker = worker or f'{socket.gethostname()}:{os.getpid()}'
+    done = 0
+    while max_chunks is None or done < max_chunks:
+      chunk = self.claim(worker)
+      if chunk is None:
+        if not self.get_progress()['running']:
+          break
+        time.sleep(poll)
+        continue
+
+      try:
+        scores = self.score_chunk(chunk)
+      except BaseException:
+        self.release(chunk)
+        raise
+      self.complete(chunk, scores)
+      done += 1
+    return done
+
+  def get_progress(self):
+    """{status: number of chunks}"""
+    rows = self.db.execute('SELECT status, COUNT(*) FROM chunks GROUP BY status').fetchall()
+    return {'pending': 0, 'running': 0, 'done': 0, **dict(rows)}
+
+  def is_done(self):
+    return self.get_progress()['done'] == self.manifest['num_chunks']
+
+  def iter_chunks(self):
+    """(start mask, scores) for every finished chunk, in order.
+
+    Raises ValueError for a chunk that doesn't fit the manifest.
+    """
+    rows = self.db.execute("SELECT chunk FROM chunks WHERE status = 'done' ORDER BY chunk").fetchall()
+    for chunk, in rows:
+      start, stop = self.get_mask_range(chunk)
+      scores = np.load(self.get_chunk_path(chunk))
+      shape = (stop - start, len(self.manifest['names']))
+      if scores.shape != shape:
+        raise ValueError(f'Chunk {chunk} has shape {scores.shape}, expected {shape}.')
+      yield start, scores
+
+  def gather(self, path):
+    """Stitch the finished job into a table readable by `store.ScoreTable`."""
+    if not self.is_done():
+      raise ValueError(f'Job is not finished: {self.get_progress()}')
+
+    chunks = self.iter_chunks()
+    start, first = next(chunks)
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+      json.dump({'names': self.manifest['names'], 'depth': self.manifest['depth']}, f, indent=2)
+
+    scores = np.lib.format.open_memmap(
+      os.path.join(path, 'scores.npy'),
+      mode='w+',
+      dtype=first.dtype,
+      shape=(self.manifest['num_scenarios'], len(self.manifest['names'])),
+      fortran_order=True,
+    )
+    scores[start:start + len(first)] = first
+    for start, chunk_scores in chunks:
+      scores[start:start + len(chunk_scores)] = chunk_scores
+    scores.flush()
+    del scores
+
+    return store.ScoreTable(path)
+
+  def close(self):
+    self.db.close()
+
+
+def is_alive(pid):
+  """Whether a process with this id is running on this machine."""
+  try:
+    os.kill(pid, 0)
+  except ProcessLookupError:
+    return False
+  except PermissionError:
+    return True
+  return True
+
+
+def _run_worker(path, lease):
+  job = ScenarioJob(path, lease=lease)
+  try:
+    return job.run()
+  finally:
+    job.close()
+
+
+def run_local(path, workers=None, lease=600):
+  """Run a job to the end on `workers` local processes. Returns chunks done per worker."""
+  import concurrent.futures
+
+  workers = workers or os.cpu_count()
+  with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+    futures = [executor.submit(_run_worker, path, lease) for _ in range(workers)]
+    return [future.result() for future in futures]
+
+
+if __name__ == '__main__':  # debug time
+  import sys
+
+  import scenarios
+
+  # Run it, kill it partway, run it again: it picks up where it stopped.
+  path = sys.argv[1] if len(sys.argv) > 1 else 'scenario_job'
+  if not os.path.exists(os.path.join(path, 'manifest.json')):
+    ScenarioJob.create(path, scenarios.sweet_sixteen, scenarios.load_brackets(), chunk_size=2 ** 12)
+
+  print(run_local(path, workers=4))
+  job = ScenarioJob(path)
+  print(job.get_progress())
+  table = job.gather('scenario_scores')
+  print(table.to_dataframe(0, 4))
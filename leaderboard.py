@@ -0,0 +1,202 @@
+"""leaderboard.py
+
+Keep a pool's standings up to date as games finish, one result at a time.
+
+A result only changes the score of the entries that picked its winner
+(or, for a correction, its old winner) in that game, so entries are
+indexed by (game, team) and only those get touched. A team only plays
+one game per round, so this is the same as indexing by (team, round).
+
+Max possible scores are kept up to date the same way. Along with each
+entry's max, remember a scenario that gets it. A result that agrees with
+that scenario can't lower the max, so only entries whose best scenario
+just became impossible are recomputed.
+"""
+import numpy as np
+
+import batch
+from bracket import TEAMS, ArrayBracket, get_heap_nodes
+
+
+class Leaderboard:
+  def __init__(self, actual, brackets, depth=3, rules=None, teams=TEAMS):
+    """
+    actual (MatchupTree): the results so far. The trees in
+      `actual.get_every_tree(depth)` are the games still to be played;
+      their winners are placeholders until `record_result` fills them in.
+    brackets (dict): MatchupTree or ArrayBracket entries by name.
+    rules (scoring.ScoringRules): defaults to 320 points per round.
+    """
+    self.actual = actual
+    self.names = list(brackets)
+    self.teams = teams
+
+    base = ArrayBracket.from_tree(actual, teams=teams)
+    self.nodes = get_heap_nodes(actual)
+    self.winners = base.winners.copy()
+    self.num_games = base.num_games
+    self.num_trees = 2 ** (depth + 1) - 1
+    self.decided = np.zeros(self.num_trees, dtype=bool)
+
+    self.picks = batch.get_pick_matrix(brackets.values(), teams=teams)
+    self.picks_by_game = np.ascontiguousarray(self.picks.T)
+    weights = batch.get_weights(base, rules)
+    self.weights = batch.get_weight_table(weights, len(teams))
+
+    # Entries by (game, team picked to win it), for the remaining games.
+    self.index = {}
+    for slot in range(self.num_trees):
+      for team_id in np.unique(self.picks_by_game[slot]):
+        self.index[slot, team_id] = np.flatnonzero(self.picks_by_game[slot] == team_id)
+
+    final = np.arange(self.num_trees, self.num_games)
+    self.scores = (self.picks[:, final] == self.winners[final]) @ self.weights[final, self.winners[final]]
+    self.scores_final = self.scores.copy()
+
+    everyone = np.arange(len(self.names))
+    self.max_scores = np.empty(len(self.names))
+    self.witness = np.empty((len(self.names), self.num_trees), dtype=self.winners.dtype)
+    self.max_scores[everyone], self.witness[everyone] = self.get_max_scenarios(everyone)
+
+  def get_max_scenarios(self, entries):
+    """Max possible score of some entries, and a scenario that gets it.
+
+    entries (int array): entry indices.
+
+    Returns (max scores, winners), where winners has one row per entry
+    with the winner of every remaining game in its best scenario.
+    """
+    picks = self.picks_by_game[:, entries]
+
+    # For every team that could win a game: the most points available at
+    # and below that game if it does, for each entry.
+    options = {}
+
+    def get_options(node):
+      if node in options:
+        return options[node]
+      return self.winners[node:node + 1], np.zeros((1, len(entries)))
+
+    for slot in reversed(range(self.num_trees)):
+      child_options = [get_options(2 * slot + 1), get_options(2 * slot + 2)]
+      parts = []
+      for side in (0, 1):
+        teams, gains = child_options[side]
+        _, gains_other = child_options[1 - side]
+        if self.decided[slot]:
+          keep = teams == self.winners[slot]
+          teams, gains = teams[keep], gains[keep]
+        points = self.weights[slot, teams][:, None] * (teams[:, None] == picks[slot])
+        parts.append((teams, gains + gains_other.max(axis=0) + points))
+      options[slot] = tuple(np.concatenate(arrays) for arrays in zip(*parts))
+
+    teams, gains = options[0]
+    max_scores = self.scores_final[entries] + gains.max(axis=0)
+
+    # Walk back down: the chosen team came up from one side, and the
+    # other side's best team is the one that loses to it.
+    witness = np.empty((len(entries), self.num_trees), dtype=self.winners.dtype)
+    witness[:, 0] = teams[gains.argmax(axis=0)]
+    for slot in range(self.num_trees):
+      for child in (2 * slot + 1, 2 * slot + 2):
+        if child not in options:
+          continue
+        teams, gains = options[child]
+        came_up = (teams[:, None] == witness[:, slot]).any(axis=0)
+        witness[:, child] = np.where(came_up, witness[:, slot], teams[gains.argmax(axis=0)])
+
+    return max_scores, witness
+
+  def find_game(self, team_id, opponent_id):
+    """Heap slot of the remaining game between two teams."""
+    for slot in reversed(range(self.num_trees)):
+      children = {self.winners[2 * slot + 1], self.winners[2 * slot + 2]}
+      if children == {team_id, opponent_id}:
+        if any(child < self.num_trees and not self.decided[child] for child in (2 * slot + 1, 2 * slot + 2)):
+          raise ValueError('Both teams need to have won their way to this game first.')
+        return slot
+    raise ValueError(
+      f'{self.teams.name(team_id)} and {self.teams.name(opponent_id)} '
+      f'do not meet in any of the remaining games.'
+    )
+
+  def record_result(self, winner, loser):
+    """Apply the result of one game, or correct one already recorded.
+
+    winner, loser (str): team names.
+
+    Returns the names of the entries whose score changed.
+    """
+    winner_id, loser_id = self.teams.ids[winner], self.teams.ids[loser]
+    slot = self.find_game(winner_id, loser_id)
+    parent = (slot - 1) // 2
+
+    was_decided = self.decided[slot]
+    if was_decided and self.winners[slot] == winner_id:
+      return []
+    if was_decided and slot > 0 and self.decided[parent]:
+      raise ValueError(f'The game after {winner} vs {loser} has already been recorded.')
+
+    # Keep the MatchupTree in step, then the placeholder winners above it.
+    tree = self.nodes[slot]
+    if tree.winner_name != winner:
+      tree.switch_winner()
+    old = self.winners[slot]
+    node = slot
+    while node >= 0 and self.winners[node] == old:
+      self.winners[node] = winner_id
+      node = (node - 1) // 2
+    self.decided[slot] = True
+
+    changed = [self.index.get((slot, winner_id), np.empty(0, dtype=np.intp))]
+    self.scores[changed[0]] += self.weights[slot, winner_id]
+    if was_decided:
+      # Correction: take back what the old winner's pickers got.
+      changed.append(self.index.get((slot, old), np.empty(0, dtype=np.intp)))
+      self.scores[changed[1]] -= self.weights[slot, old]
+
+    stale = np.flatnonzero(self.witness[:, slot] != winner_id)
+    if len(stale):
+      self.max_scores[stale], self.witness[stale] = self.get_max_scenarios(stale)
+
+    return [self.names[entry] for entry in np.concatenate(changed)]
+
+  def get_remaining_games(self):
+    """(team, team) for every game that's ready to be played."""
+    games = []
+    for slot in range(self.num_trees):
+      if self.decided[slot]:
+        continue
+      children = (2 * slot + 1, 2 * slot + 2)
+      if all(child >= self.num_trees or self.decided[child] for child in children):
+        games.append(tuple(self.teams.name(self.winners[child]) for child in children))
+    return games
+
+  def get_standings(self):
+    """DataFrame of every entry's score, max possible score and rank, best first."""
+    ranks = batch.get_ranks(self.scores[None])[0]
+
+    import pandas as pd
+    df = pd.DataFrame(
+      {'rank': ranks, 'score': self.scores, 'max_possible': self.max_scores},
+      index=self.names,
+    )
+    return df.sort_values(['rank', 'max_possible'], ascending=[True, False])
+
+
+if __name__ == '__main__':  # debug time
+  import scenarios
+
+  leaderboard = Leaderboard(scenarios.sweet_sixteen, scenarios.load_brackets())
+  print(leaderboard.get_standings())
+
+  # Play out the tournament as it's currently filled in.
+  while leaderboard.get_remaining_games():
+    team, opponent = leaderboard.get_remaining_games()[0]
+    slot = leaderboard.find_game(leaderboard.teams.ids[team], leaderboard.teams.ids[opponent])
+    winner = leaderboard.nodes[slot].winner_name
+    loser = opponent if winner == team else team
+    changed = leaderboard.record_result(winner, loser)
+    print(f'{winner} over {loser}: {len(changed)} entries scored')
+
+  print(leaderboard.get_standings())
@@ -0,0 +1,108 @@
+"""leverage.py
+
+Which of the remaining games matter most to each entry.
+
+For every remaining game (the trees from `hypo_bracket.get_every_tree(depth)`)
+and both ways it can go, find each entry's chance of finishing first and
+its expected finishing position over the scenarios where it goes that
+way. Every scenario is counted once, like in `scenarios.generate_dataframe`.
+
+Nothing gets re-enumerated per game: each chunk of scenarios is scored
+and ranked once, and the per-game sums come from one matrix product of
+the chunk's switches with its wins and ranks.
+"""
+import numpy as np
+
+import batch
+from bracket import TEAMS, ArrayBracket
+
+
+def get_leverage(hypo_bracket, brackets, depth=3, chunk_size=None, rules=None, teams=TEAMS):
+  """Win probability and expected rank of every entry, given each game's outcome.
+
+  brackets (dict): MatchupTree or ArrayBracket entries by name.
+  chunk_size (int): scenarios scored at once. Defaults to about 4M
+    scores' worth.
+  rules (scoring.ScoringRules): defaults to 320 points per round.
+
+  Returns (win_probs, expected_ranks), each (2 x trees x entries): index
+  0 is the tree's current winner winning, 1 is the tree switched. Ties
+  for first count as a win.
+  """
+  base = ArrayBracket.from_tree(hypo_bracket, teams=teams)
+  slots, sides = batch.get_scenario_slots(hypo_bracket, depth)
+  picks = batch.get_pick_matrix(brackets.values(), teams=teams)
+  weights = batch.get_weights(base, rules)
+
+  num_trees = len(slots)
+  num_scenarios = 2 ** num_trees
+  if chunk_size is None:
+    chunk_size = max(1, 2 ** 22 // len(picks))
+
+  win_totals = np.zeros(len(picks))
+  rank_totals = np.zeros(len(picks))
+  win_switched = np.zeros((num_trees, len(picks)))
+  rank_switched = np.zeros((num_trees, len(picks)))
+
+  for _, switches, outcomes in batch.iter_outcome_chunks(base, slots, sides, chunk_size):
+    ranks = batch.get_ranks(batch.get_score_table(outcomes, picks, weights))
+
+    wins = (ranks == 1).astype(np.float64)
+    ranks = ranks.astype(np.float64)
+    switches = switches.astype(np.float64)
+    win_totals += wins.sum(axis=0)
+    rank_totals += ranks.sum(axis=0)
+    win_switched += switches.T @ wins
+    rank_switched += switches.T @ ranks
+
+  # Each tree is switched in exactly half the scenarios.
+  half = num_scenarios / 2
+  win_probs = np.stack([win_totals - win_switched, win_switched]) / half
+  expected_ranks = np.stack([rank_totals - rank_switched, rank_switched]) / half
+  return win_probs, expected_ranks
+
+
+def leverage_report(hypo_bracket, brackets=None, depth=3, rules=None):
+  """DataFrame of how much each remaining game swings each entry's finish.
+
+  One row per (entry, game), sorted so the games that swing an entry's
+  chance of winning the most come first. `winner` and `loser` are the
+  two sides of the game as `hypo_bracket` has them filled in now.
+  """
+  if brackets is None:
+    import scenarios
+    brackets = scenarios.load_brackets()
+
+  win_probs, expected_ranks = get_leverage(hypo_bracket, brackets, depth, rules=rules)
+  trees = hypo_bracket.get_every_tree(depth)
+
+  import pandas as pd
+  df = pd.DataFrame({
+    'entry': np.repeat(list(brackets), len(trees)),
+    'game': np.tile(np.arange(len(trees)), len(brackets)),
+    'winner': [tree.winner_name for tree in trees] * len(brackets),
+    'loser': [tree.loser_name for tree in trees] * len(brackets),
+    'win_if_winner': win_probs[0].T.ravel(),
+    'win_if_loser': win_probs[1].T.ravel(),
+    'rank_if_winner': expected_ranks[0].T.ravel(),
+    'rank_if_loser': expected_ranks[1].T.ravel(),
+  })
+  df['win_swing'] = df['win_if_winner'] - df['win_if_loser']
+  df['rank_swing'] = df['rank_if_winner'] - df['rank_if_loser']
+
+  # Entries in pool order, biggest swings first within each.
+  entry_order = np.repeat(np.arange(len(brackets)), len(trees))
+  order = np.lexsort((-df['win_swing'].abs().to_numpy(), entry_order))
+  df = df.iloc[order].set_index(['entry', 'game'])
+  return df
+
+
+if __name__ == '__main__':  # debug time
+  import time
+
+  import scenarios
+
+  t0 = time.time()
+  df = leverage_report(scenarios.sweet_sixteen)
+  print(f'{1000 * (time.time() - t0):.1f} ms')
+  print(df.loc['sally'].head())
@@ -0,0 +1,123 @@
+"""loader.py
+
+Load a directory of XML brackets, skipping the XML parsing for files
+that haven't changed since the last run.
+
+Parsed brackets are pickled into one cache file, keyed by path. A file
+is reused when its mtime and size match; if they don't, its content hash
+gets a second chance before the file is parsed again. Files that do need
+parsing are parsed in parallel.
+"""
+import concurrent.futures
+import glob
+import hashlib
+import os
+import pickle
+import xml.etree.ElementTree as ET
+
+from matchup import MatchupTree
+
+
+CACHE_PATH = '.bracket_cache.pickle'
+
+# Bump when MatchupTree's attributes change, so stale pickles get dropped.
+CACHE_VERSION = 3
+
+
+def parse_xml(content):
+  return MatchupTree.from_xml(ET.fromstring(content))
+
+
+def read_cache(cache_path):
+  try:
+    with open(cache_path, 'rb') as f:
+      cache = pickle.load(f)
+  except (OSError, EOFError, pickle.UnpicklingError):
+    return {}
+
+  if not isinstance(cache, dict) or cache.get('version') != CACHE_VERSION:
+    return {}
+  return cache['files']
+
+
+def write_cache(cache_path, cache):
+  # Write then rename, so a crash never leaves a half-written cache.
+  tmp_path = f'{cache_path}.tmp'
+  with open(tmp_path, 'wb') as f:
+    pickle.dump({'version': CACHE_VERSION, 'files': cache}, f, protocol=pickle.HIGHEST_PROTOCOL)
+  os.replace(tmp_path, cache_path)
+
+
+def read_xml_files(paths, cache_path=CACHE_PATH, workers=None):
+  """{path: MatchupTree} for every path, parsing only what changed.
+
+  workers (int): max processes to parse with. 1 parses in this process.
+  """
+  cache = read_cache(cache_path)
+  changed = False
+
+  brackets = {}
+  to_parse = {}
+  for path in paths:
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    entry = cache.get(path)
+    if entry is not None and entry['key'] == key:
+      brackets[path] = entry['bracket']
+      continue
+
+    with open(path, 'rb') as f:
+      content = f.read()
+    digest = hashlib.sha1(content).hexdigest()
+    if entry is not None and entry['digest'] == digest:
+      entry['key'] = key
+      brackets[path] = entry['bracket']
+    else:
+      to_parse[path] = (key, digest, content)
+    changed = True
+
+  if len(to_parse) > 1 and workers != 1:
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+      parsed = executor.map(parse_xml, [content for _, _, content in to_parse.values()])
+      parsed = dict(zip(to_parse, parsed))
+  else:
+    parsed = {path: parse_xml(content) for path, (_, _, content) in to_parse.items()}
+
+  for path, (key, digest, _) in to_parse.items():
+    parsed[path].base_hash  # cache this along with the bracket
+    cache[path] = {'key': key, 'digest': digest, 'bracket': parsed[path]}
+    brackets[path] = parsed[path]
+
+  if changed:
+    write_cache(cache_path, cache)
+
+  return brackets
+
+
+def load_pool(pattern='data/*.xml', cache_path=CACHE_PATH, workers=None, base=None):
+  """Load every bracket, eg brackets['sar_1'] = MatchupTree('Gonzaga')
+
+  base (MatchupTree): if given, every bracket must have the same teams
+    in the same matchups as this one (see MatchupTree.is_same_base).
+  """
+  paths = sorted(glob.glob(pattern))
+  trees = read_xml_files(paths, cache_path=cache_path, workers=workers)
+  brackets = {os.path.splitext(os.path.basename(path))[0]: trees[path] for path in paths}
+
+  if base is not None:
+    mismatched = [name for name, bracket in brackets.items() if not bracket.is_same_base(base)]
+    if mismatched:
+      raise ValueError(f'Brackets with a different base: {", ".join(mismatched)}')
+
+  return brackets
+
+
+if __name__ == '__main__':  # debug time
+  import time
+
+  for label in ['cold', 'warm']:
+    if label == 'cold' and os.path.exists(CACHE_PATH):
+      os.remove(CACHE_PATH)
+    t0 = time.time()
+    brackets = load_pool()
+    print(f'{label}: {len(brackets)} brackets in {1000 * (time.time() - t0):.1f} ms')
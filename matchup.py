@@ -1,7 +1,6 @@
+import hashlib
 import xml.etree.ElementTree as ET
 
-import util
-
 
 class MatchupTree:
   def __init__(self, winner, loser):
@@ -18,22 +17,80 @@ class MatchupTree:
     if not isinstance(loser, (str, classtype)):
       raise TypeError(f'`loser` arg must be str or {classtype.__name__}')
 
-    self.winner = winner
-    self.loser = loser
+    self._winner = winner
+    self._loser = loser
+    self._parent = None
+    for child in (winner, loser):
+      if isinstance(child, MatchupTree):
+        child._parent = self
+
+    # Cached on first use. `winner_name` and `depth` only depend on the
+    # chain of winners below this tree, `base_hash` on the whole subtree.
+    self._winner_name = None
+    self._depth = None
+    self._base_hash = None
+
+  @property
+  def winner(self):
+    return self._winner
+
+  @winner.setter
+  def winner(self, value):
+    self._replace_child('_winner', value)
+
+  @property
+  def loser(self):
+    return self._loser
+
+  @loser.setter
+  def loser(self, value):
+    self._replace_child('_loser', value)
+
+  @property
+  def parent(self):
+    """The tree this one feeds into, if any."""
+    return self._parent
+
+  def _replace_child(self, attr, value):
+    classtype = type(self)
+    if not isinstance(value, (str, classtype)):
+      raise TypeError(f'`{attr[1:]}` must be str or {classtype.__name__}')
+
+    setattr(self, attr, value)
+    if isinstance(value, MatchupTree):
+      value._parent = self
+
+    # A new competitor can change anything cached above here.
+    tree = self
+    while tree is not None:
+      tree._winner_name = tree._depth = tree._base_hash = None
+      tree = tree._parent
+
+  def _invalidate_winner(self):
+    """Forget the cached winners that depend on who won this game."""
+    tree = self
+    while True:
+      tree._winner_name = tree._depth = None
+      parent = tree._parent
+      if parent is None or parent._winner is not tree:
+        break
+      tree = parent
 
   @property
   def winner_name(self):
-    if isinstance(self.winner, str):
-      return self.winner
-    else:
-      return self.winner.winner_name
+    if self._winner_name is None:
+      if isinstance(self._winner, str):
+        self._winner_name = self._winner
+      else:
+        self._winner_name = self._winner.winner_name
+    return self._winner_name
 
   @property
   def loser_name(self):
-    if isinstance(self.loser, str):
-      return self.loser
+    if isinstance(self._loser, str):
+      return self._loser
     else:
-      return self.loser.winner_name
+      return self._loser.winner_name
 
   @property
   def depth(self):
@@ -41,19 +98,26 @@ class MatchupTree:
     
     depth = 0 means this tree is just a game.
     """
-    max_depth = 0
-    elem = self
-    while isinstance(elem.winner, MatchupTree):
-      max_depth += 1
-      elem = elem.winner
+    if self._depth is None:
+      if isinstance(self._winner, MatchupTree):
+        self._depth = self._winner.depth + 1
+      else:
+        self._depth = 0
+    return self._depth
 
-    return max_depth
+  def score(self, actual, rules=None):
+    """Score this MatchupTree against another representing the actual results.
 
-  def score(self, actual):
-    """Score this MatchupTree against another representing the actual results."""   
+    rules (scoring.ScoringRules): defaults to 320 points per round.
+    """
+    if rules is not None:
+      return rules.score(self, actual)
     return sum([self.score_by_depth(actual, i) for i in range(self.depth + 1)])
 
-  def score_by_depth(self, actual, depth):
+  def score_by_depth(self, actual, depth, rules=None):
+    if rules is not None:
+      return rules.score_by_depth(self, actual, depth)
+
     points_per_round = 320  # accept as input
 
     # if not self.is_same_base(actual):
@@ -66,12 +130,86 @@ class MatchupTree:
 
     return points_per_game * sum([team in teams2 for team in teams1])
 
+  def max_possible_score(self, actual_so_far, depth=3, rules=None):
+    """Best score this bracket can still get, and a scenario that gets it.
+
+    The trees in `actual_so_far.get_every_tree(depth)` are the games still
+    to be played; everything below them is final. Instead of trying every
+    scenario, work up the remaining games once, keeping the most points
+    available below each game for every team that could win it.
+
+    Returns (score, mask), where bit i of `mask` is set when tree i of
+    `actual_so_far.get_every_tree(depth)` has to be switched.
+    """
+    points_per_round = 320  # accept as input
+
+    picks = [set(self.get_names_by_depth(i)) for i in range(depth + 1)]
+    score_final = sum([self.score_by_depth(actual_so_far, i, rules) for i in range(depth + 1, self.depth + 1)])
+    if rules is not None:
+      points_by_depth = rules.get_points_by_depth(actual_so_far)
+
+    # For every remaining game, the best points below it by team, on each side.
+    options_by_side = {}
+
+    def get_options(tree, level):
+      if isinstance(tree, str):
+        return {tree: 0}
+      if level > depth:
+        return {tree.winner_name: 0}
+
+      if rules is None:
+        points_per_game = dict.fromkeys(picks[level], points_per_round / 2 ** level)
+      else:
+        points_per_game = points_by_depth[level]
+      options_winner = get_options(tree.winner, level + 1)
+      options_loser = get_options(tree.loser, level + 1)
+      options_by_side[id(tree)] = (options_winner, options_loser)
+
+      options = {}
+      for options_side, options_other in [(options_winner, options_loser), (options_loser, options_winner)]:
+        best_other = max(options_other.values())
+        for team, points in options_side.items():
+          options[team] = points + best_other + (points_per_game[team] if team in picks[level] else 0)
+
+      return options
+
+    options = get_options(actual_so_far, 0)
+    champion = max(options, key=options.get)
+
+    # Walk back down to find which trees get switched along the way.
+    index = {id(tree): i for i, tree in enumerate(actual_so_far.get_every_tree(depth))}
+    mask = 0
+    stack = [(actual_so_far, champion)]
+    while stack:
+      tree, team = stack.pop()
+      if id(tree) not in options_by_side:
+        continue
+      options_winner, options_loser = options_by_side[id(tree)]
+      if team in options_winner:
+        stack.append((tree.winner, team))
+        stack.append((tree.loser, max(options_loser, key=options_loser.get)))
+      else:
+        mask |= 1 << index[id(tree)]
+        stack.append((tree.loser, team))
+        stack.append((tree.winner, max(options_winner, key=options_winner.get)))
+
+    return score_final + options[champion], mask
+
   def is_same_base(self, other):
     """Check if this bracket represents the same set of competitors as another"""
-    root1 = util.get_sorted_clean_elem(self.to_xml())
-    root2 = util.get_sorted_clean_elem(other.to_xml())
-        
-    return ET.tostring(root1) == ET.tostring(root2)
+    return self.base_hash == other.base_hash
+
+  @property
+  def base_hash(self):
+    """Hash of the competitors and how they are paired up, ignoring who won.
+
+    Each game hashes its two children's hashes in sorted order, so
+    switching winners doesn't change it. Computed once per tree.
+    """
+    if self._base_hash is None:
+      child_hashes = sorted([get_base_hash(self.winner), get_base_hash(self.loser)])
+      self._base_hash = hashlib.blake2b(b'G' + b''.join(child_hashes), digest_size=16).digest()
+    return self._base_hash
 
   def get_names_by_depth(self, depth):
     """Return a list of competitors based on depth in the bracket.
@@ -200,10 +338,13 @@ class MatchupTree:
 
   def switch_winner(self):
     """Switch the winner and loser of the game this tree represents."""
-    new_winner = self.loser
-    new_loser = self.winner
-    self.winner = new_winner
-    self.loser = new_loser
+    new_winner = self._loser
+    new_loser = self._winner
+    self._winner = new_winner
+    self._loser = new_loser
+
+    # Same competitors, so only the winners up the bracket need redoing.
+    self._invalidate_winner()
 
   def get_trees_by_depth(self, depth):
     curr_depth = 0
@@ -317,6 +458,13 @@ class MatchupTree:
     return new_box, len(new_box[0]), new_root_start, new_root_end
 
 
+def get_base_hash(competitor):
+  """MatchupTree.base_hash, or the equivalent for a team name."""
+  if isinstance(competitor, str):
+    return hashlib.blake2b(b'T' + competitor.encode(), digest_size=16).digest()
+  return competitor.base_hash
+
+
 class MatchupTreeOld:
   def __init__(self, winner, left=None, right=None):
     self.winner = winner
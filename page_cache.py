@@ -0,0 +1,93 @@
+"""page_cache.py
+
+On-disk cache of raw entry pages for the scraper.
+
+Page bodies are stored once each, named by their SHA-256, and a small
+SQLite index records every fetch of every entry: when, which body, and
+the ETag / Last-Modified headers to revalidate it with next time.
+"""
+import hashlib
+import os
+import sqlite3
+import time
+
+
+class PageCache:
+  def __init__(self, path):
+    self.path = path
+    os.makedirs(os.path.join(path, 'bodies'), exist_ok=True)
+    self.db = sqlite3.connect(os.path.join(path, 'index.sqlite'))
+    self.db.execute('''
+      CREATE TABLE IF NOT EXISTS fetches (
+        entry_id TEXT NOT NULL,
+        fetched_at REAL NOT NULL,
+        digest TEXT NOT NULL,
+        etag TEXT,
+        last_modified TEXT
+      )
+    ''')
+    self.db.execute('CREATE INDEX IF NOT EXISTS fetches_entry ON fetches (entry_id, fetched_at)')
+    self.db.commit()
+
+  def get_body_path(self, digest):
+    return os.path.join(self.path, 'bodies', digest[:2], digest)
+
+  def put(self, entry_id, body, etag=None, last_modified=None):
+    """Record a fresh fetch of an entry page."""
+    digest = hashlib.sha256(body).hexdigest()
+    body_path = self.get_body_path(digest)
+    if not os.path.exists(body_path):
+      os.makedirs(os.path.dirname(body_path), exist_ok=True)
+      tmp_path = f'{body_path}.tmp'
+      with open(tmp_path, 'wb') as f:
+        f.write(body)
+      os.replace(tmp_path, body_path)
+
+    self.add_fetch(entry_id, digest, etag, last_modified)
+    return digest
+
+  def add_fetch(self, entry_id, digest, etag=None, last_modified=None):
+    self.db.execute(
+      'INSERT INTO fetches VALUES (?, ?, ?, ?, ?)',
+      (str(entry_id), time.time(), digest, etag, last_modified),
+    )
+    self.db.commit()
+
+  def get_latest(self, entry_id):
+    """(digest, etag, last_modified) of the latest fetch, or None."""
+    return self.db.execute(
+      'SELECT digest, etag, last_modified FROM fetches WHERE entry_id = ? '
+      'ORDER BY fetched_at DESC LIMIT 1',
+      (str(entry_id),),
+    ).fetchone()
+
+  def get(self, entry_id):
+    """Latest body fetched for an entry, or None."""
+    latest = self.get_latest(entry_id)
+    if latest is None:
+      return None
+    with open(self.get_body_path(latest[0]), 'rb') as f:
+      return f.read()
+
+  def get_validators(self, entry_id):
+    """Headers for a conditional request against the latest fetch."""
+    latest = self.get_latest(entry_id)
+    headers = {}
+    if latest is not None:
+      _, etag, last_modified = latest
+      if etag:
+        headers['If-None-Match'] = etag
+      if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    return headers
+
+  def revalidated(self, entry_id):
+    """Record that the server says the latest body is still current."""
+    digest, etag, last_modified = self.get_latest(entry_id)
+    self.add_fetch(entry_id, digest, etag, last_modified)
+
+  def get_entry_ids(self):
+    return [row[0] for row in self.db.execute('SELECT DISTINCT entry_id FROM fetches')]
+
+  def close(self):
+    self.db.close()
@@ -0,0 +1,110 @@
+"""parallel.py
+
+Score scenarios on every core.
+
+The scenario space is split into shards by the top switch bits, so each
+shard is a contiguous block of scenario masks. Worker processes get the
+pool's picks once, through shared memory, and write their scores
+straight into a shared output table, so the result comes out in
+scenario order with no merging step.
+"""
+import concurrent.futures
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import batch
+from bracket import TEAMS, ArrayBracket
+
+
+# Set in each worker process by `_init_worker`.
+_worker = {}
+
+
+def _attach(name, shape, dtype):
+  shm = shared_memory.SharedMemory(name=name)
+  return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _init_worker(picks_spec, scores_spec, winners, slots, sides, weights):
+  picks_shm, picks = _attach(*picks_spec)
+  scores_shm, scores = _attach(*scores_spec)
+  _worker.update(
+    shms=(picks_shm, scores_shm),
+    picks=picks,
+    scores=scores,
+    base=ArrayBracket(winners),
+    slots=slots,
+    sides=sides,
+    weights=weights,
+  )
+
+
+def _score_shard(start, stop, chunk_size):
+  w = _worker
+  chunks = batch.iter_outcome_chunks(w['base'], w['slots'], w['sides'], chunk_size, start, stop)
+  for chunk_start, _, outcomes in chunks:
+    w['scores'][chunk_start:chunk_start + len(outcomes)] = batch.get_score_table(outcomes, w['picks'], w['weights'])
+
+
+def get_score_table_parallel(hypo_bracket, picks, depth=3, workers=None, shard_bits=None,
+                             chunk_size=2 ** 14, rules=None, teams=TEAMS):
+  """Same table as `batch.get_score_table`, computed across a process pool.
+
+  workers (int): number of processes, defaults to one per CPU.
+  shard_bits (int): split the scenarios into 2 ** shard_bits shards.
+    Defaults to about four shards per worker.
+  rules (scoring.ScoringRules): defaults to 320 points per round.
+  """
+  workers = workers or os.cpu_count()
+  base = ArrayBracket.from_tree(hypo_bracket, teams=teams)
+  slots, sides = batch.get_scenario_slots(hypo_bracket, depth)
+  weights = batch.get_weights(base, rules)
+
+  num_scenarios = 2 ** len(slots)
+  if shard_bits is None:
+    shard_bits = (4 * workers - 1).bit_length()
+  shard_bits = min(shard_bits, len(slots))
+  shard_size = num_scenarios >> shard_bits
+
+  picks = np.ascontiguousarray(picks)
+  shape = (num_scenarios, len(picks))
+  picks_shm = shared_memory.SharedMemory(create=True, size=max(1, picks.nbytes))
+  scores_shm = shared_memory.SharedMemory(create=True, size=max(1, np.dtype(np.float64).itemsize * shape[0] * shape[1]))
+  try:
+    np.ndarray(picks.shape, dtype=picks.dtype, buffer=picks_shm.buf)[:] = picks
+    scores = np.ndarray(shape, dtype=np.float64, buffer=scores_shm.buf)
+
+    initargs = (
+      (picks_shm.name, picks.shape, picks.dtype),
+      (scores_shm.name, shape, np.float64),
+      base.winners, slots, sides, weights,
+    )
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=_init_worker, initargs=initargs) as executor:
+      futures = [
+        executor.submit(_score_shard, start, start + shard_size, chunk_size)
+        for start in range(0, num_scenarios, shard_size)
+      ]
+      for future in futures:
+        future.result()
+
+    return scores.copy()
+  finally:
+    picks_shm.close()
+    picks_shm.unlink()
+    scores_shm.close()
+    scores_shm.unlink()
+
+
+if __name__ == '__main__':  # debug time
+  import time
+
+  import scenarios
+
+  brackets = scenarios.load_brackets()
+  picks = batch.get_pick_matrix(brackets.values())
+  for workers in [1, os.cpu_count()]:
+    t0 = time.time()
+    scores = scenarios.get_score_table(scenarios.sweet_sixteen, picks, workers=workers)
+    print(f'{workers} workers: {scores.shape} in {1000 * (time.time() - t0):.1f} ms')
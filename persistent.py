@@ -0,0 +1,156 @@
+"""persistent.py
+
+An immutable MatchupTree for keeping lots of scenarios alive at once.
+
+Switching a game returns a new tree that shares every untouched subtree
+with the old one, so a scenario costs about as much memory as the games
+it changed. Trees are hash-consed: building a game out of the same two
+competitors twice gives back the same object, which also means
+scenarios that reach the same result share all of it. Nothing is ever
+mutated, so trees are safe to share between threads.
+"""
+import hashlib
+import threading
+import weakref
+
+from matchup import MatchupTree, get_base_hash
+
+
+class PersistentTree:
+  __slots__ = ('winner', 'loser', 'winner_name', 'depth', 'base_hash', '__weakref__')
+
+  # Every live game, keyed by (winner, loser). Children are interned
+  # first, so identity is equality.
+  _interned = weakref.WeakValueDictionary()
+  _lock = threading.Lock()
+
+  def __new__(cls, winner, loser):
+    """Return the game between winner and loser, reusing it if it already exists.
+
+    winner, loser (PersistentTree or str)
+    """
+    key = (winner, loser)
+    with cls._lock:
+      tree = cls._interned.get(key)
+      if tree is not None:
+        return tree
+
+      if not isinstance(winner, (str, cls)):
+        raise TypeError(f'`winner` arg must be str or {cls.__name__}')
+      if not isinstance(loser, (str, cls)):
+        raise TypeError(f'`loser` arg must be str or {cls.__name__}')
+
+      tree = super().__new__(cls)
+      object.__setattr__(tree, 'winner', winner)
+      object.__setattr__(tree, 'loser', loser)
+      object.__setattr__(tree, 'winner_name', winner if isinstance(winner, str) else winner.winner_name)
+      object.__setattr__(tree, 'depth', 0 if isinstance(winner, str) else winner.depth + 1)
+      # Same as MatchupTree.base_hash, worked out once from the children's.
+      child_hashes = sorted([get_base_hash(winner), get_base_hash(loser)])
+      object.__setattr__(tree, 'base_hash', hashlib.blake2b(b'G' + b''.join(child_hashes), digest_size=16).digest())
+      cls._interned[key] = tree
+      return tree
+
+  def __setattr__(self, name, value):
+    raise AttributeError(f'{type(self).__name__} is immutable')
+
+  def __reduce__(self):
+    return (type(self), (self.winner, self.loser))
+
+  @property
+  def loser_name(self):
+    return self.loser if isinstance(self.loser, str) else self.loser.winner_name
+
+  def switch_winner(self, index=0):
+    """Return a new tree with one game's winner and loser switched.
+
+    index (int): which game, numbered like `get_every_tree`: 0 is this
+      game, 2i + 1 and 2i + 2 are the winner's and loser's side of game i.
+    """
+    if index == 0:
+      return type(self)(self.loser, self.winner)
+
+    # Walk down from the top using the bits of index + 1.
+    path = bin(index + 1)[3:]
+    return self._rebuild(path)
+
+  def _rebuild(self, path):
+    if not path:
+      return type(self)(self.loser, self.winner)
+    if path[0] == '0':
+      return type(self)(self.winner._rebuild(path[1:]), self.loser)
+    return type(self)(self.winner, self.loser._rebuild(path[1:]))
+
+  def apply_mask(self, mask, depth=3):
+    """Return the scenario `mask` (bit i = tree i of `get_every_tree(depth)` switched)."""
+    num_trees = 2 ** (depth + 1) - 1
+
+    def rebuild(tree, i):
+      if i >= num_trees or isinstance(tree, str):
+        return tree
+      winner = rebuild(tree.winner, 2 * i + 1)
+      loser = rebuild(tree.loser, 2 * i + 2)
+      if mask >> i & 1:
+        winner, loser = loser, winner
+      return type(self)(winner, loser)
+
+    return rebuild(self, 0)
+
+  def score(self, actual, rules=None):
+    return MatchupTree.score(self, actual, rules)
+
+  def score_by_depth(self, actual, depth, rules=None):
+    return MatchupTree.score_by_depth(self, actual, depth, rules)
+
+  def get_names_by_depth(self, depth):
+    return MatchupTree.get_names_by_depth(self, depth)
+
+  def get_trees_by_depth(self, depth):
+    return MatchupTree.get_trees_by_depth(self, depth)
+
+  def get_every_tree(self, depth):
+    return MatchupTree.get_every_tree(self, depth)
+
+  def is_same_base(self, other):
+    return self.base_hash == other.base_hash
+
+  @classmethod
+  def from_tree(cls, tree):
+    if isinstance(tree, str):
+      return tree
+    return cls(cls.from_tree(tree.winner), cls.from_tree(tree.loser))
+
+  def to_tree(self):
+    """A regular (mutable) MatchupTree copy of this one."""
+    winner = self.winner if isinstance(self.winner, str) else self.winner.to_tree()
+    loser = self.loser if isinstance(self.loser, str) else self.loser.to_tree()
+    return MatchupTree(winner, loser)
+
+  def to_dict(self):
+    return self.to_tree().to_dict()
+
+  def to_xml(self):
+    return self.to_tree().to_xml()
+
+  def __repr__(self):
+    return f'PersistentTree({self.winner_name}, depth={self.depth})'
+
+
+if __name__ == '__main__':  # debug time
+  import concurrent.futures
+
+  import scenarios
+
+  hypo = PersistentTree.from_tree(scenarios.sweet_sixteen)
+  guess = scenarios.read_xml_file('data/sally.xml')
+
+  # Every scenario alive at once, scored from a bunch of threads.
+  masks = list(scenarios.iter_masks())
+  trees = [hypo.apply_mask(mask) for mask in masks]
+  print(f'{len(trees)} scenario trees, {len(PersistentTree._interned)} distinct games')
+
+  with concurrent.futures.ThreadPoolExecutor(8) as executor:
+    scores = list(executor.map(guess.score, trees))
+
+  expected = scenarios.test_scenarios(scenarios.sweet_sixteen, guess)
+  print(scores == list(expected.values()))
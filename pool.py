@@ -0,0 +1,190 @@
+"""pool.py
+
+Compact binary file format for a whole pool of brackets.
+
+Every bracket in a pool has the same teams in the same first-round
+slots, so the file stores that team table once, and each entry only
+needs one bit per game: whether the game went to the first or the second
+of its two children (in ArrayBracket heap order). That's 8 bytes of
+picks for a 63-game bracket.
+
+Layout:
+  8 bytes   magic
+  4 bytes   header length, little-endian
+  header    JSON: {"version": 1, "teams": [...], "name_size": 32}, padded to 8 bytes
+  records   one per entry: name (utf-8, null-padded) + packed pick bits
+"""
+import json
+import os
+import struct
+
+import numpy as np
+
+from bracket import TEAMS, ArrayBracket
+
+
+MAGIC = b'BRKTPOOL'
+VERSION = 1
+
+
+def get_record_dtype(num_games, name_size=32):
+  return np.dtype([('name', f'S{name_size}'), ('picks', 'u1', ((num_games + 7) // 8,))])
+
+
+def pack_picks(winners):
+  """Pack heap-ordered winner arrays (entries x nodes) into pick bits."""
+  winners = np.atleast_2d(winners)
+  num_games = winners.shape[1] // 2
+  slots = np.arange(num_games)
+  second = winners[:, slots] == winners[:, 2 * slots + 2]
+  return np.packbits(second, axis=1, bitorder='little')
+
+
+def unpack_picks(bits, leaves):
+  """Rebuild (entries x games) winner IDs from pick bits and the leaf team IDs."""
+  num_games = len(leaves) - 1
+  second = np.unpackbits(bits, axis=1, count=num_games, bitorder='little').astype(bool).T
+
+  # One row per node while resolving, so each game is a contiguous write.
+  winners = np.empty((2 * num_games + 1, len(bits)), dtype=np.int16)
+  winners[num_games:] = np.asarray(leaves)[:, None]
+  for slot in reversed(range(num_games)):
+    np.copyto(winners[slot], winners[2 * slot + 2], where=second[slot])
+    np.copyto(winners[slot], winners[2 * slot + 1], where=~second[slot])
+
+  return np.ascontiguousarray(winners[:num_games].T)
+
+
+class PoolFile:
+  def __init__(self, path, teams=TEAMS):
+    """Open an existing pool file."""
+    self.path = path
+    self.teams = teams
+
+    with open(path, 'rb') as f:
+      if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError(f'{path} is not a bracket pool file.')
+      header_size, = struct.unpack('<I', f.read(4))
+      header = json.loads(f.read(header_size))
+
+    if header['version'] != VERSION:
+      raise ValueError(f'Unsupported pool file version: {header["version"]}')
+
+    self.team_names = header['teams']
+    self.leaves = np.array([teams.intern(name) for name in self.team_names], dtype=np.int16)
+    self.num_games = len(self.leaves) - 1
+    self.dtype = get_record_dtype(self.num_games, header['name_size'])
+    self.offset = len(MAGIC) + 4 + header_size
+
+  @classmethod
+  def create(cls, path, base, name_size=32, teams=TEAMS):
+    """Start an empty pool file for brackets with the same teams as `base`.
+
+    base (MatchupTree or ArrayBracket): any bracket from the pool.
+    """
+    if not isinstance(base, ArrayBracket):
+      base = ArrayBracket.from_tree(base, teams=teams)
+
+    header = json.dumps({
+      'version': VERSION,
+      'teams': [base.teams.name(t) for t in base.winners[base.num_games:]],
+      'name_size': name_size,
+    }).encode()
+    header += b' ' * (-(len(MAGIC) + 4 + len(header)) % 8)
+
+    with open(path, 'wb') as f:
+      f.write(MAGIC)
+      f.write(struct.pack('<I', len(header)))
+      f.write(header)
+
+    return cls(path, teams=teams)
+
+  def __len__(self):
+    return (os.path.getsize(self.path) - self.offset) // self.dtype.itemsize
+
+  def append(self, brackets):
+    """Add entries to the end of the file.
+
+    brackets (dict): MatchupTree or ArrayBracket entries by name.
+    """
+    records = np.zeros(len(brackets), dtype=self.dtype)
+    for i, (name, bracket) in enumerate(brackets.items()):
+      if not isinstance(bracket, ArrayBracket):
+        bracket = ArrayBracket.from_tree(bracket, teams=self.teams)
+      leaves = bracket.winners[bracket.num_games:]
+      if bracket.teams is not self.teams:
+        leaves = np.array([self.teams.intern(bracket.teams.name(t)) for t in leaves])
+      if not np.array_equal(leaves, self.leaves):
+        raise ValueError(f'{name} does not have the same teams as this pool.')
+
+      encoded = name.encode()
+      if len(encoded) > self.dtype['name'].itemsize:
+        raise ValueError(f'Entry name too long: {name}')
+      records[i]['name'] = encoded
+      records[i]['picks'] = pack_picks(bracket.winners)[0]
+
+    with open(self.path, 'ab') as f:
+      f.write(records.tobytes())
+
+  def read(self):
+    """Load the whole pool with one memory map.
+
+    Returns (names, picks): entry names and the (entries x games) array
+    of winner IDs in heap order, ready for the batch engine.
+    """
+    if len(self) == 0:
+      return [], np.empty((0, self.num_games), dtype=np.int16)
+
+    records = np.memmap(self.path, dtype=self.dtype, mode='r', offset=self.offset, shape=(len(self),))
+    names = [name.decode() for name in records['name'].tolist()]
+    return names, unpack_picks(records['picks'], self.leaves)
+
+  def get_brackets(self):
+    """{name: ArrayBracket} for every entry."""
+    names, picks = self.read()
+    winners = np.concatenate([picks, np.tile(self.leaves, (len(picks), 1))], axis=1)
+    return {name: ArrayBracket(row, teams=self.teams) for name, row in zip(names, winners)}
+
+
+def convert_xml_files(path, pattern='data/*.xml', teams=TEAMS):
+  """Build a pool file from a directory of XML brackets."""
+  import glob
+
+  from scenarios import read_xml_file
+
+  brackets = {
+    os.path.splitext(os.path.basename(fname))[0]: ArrayBracket.from_tree(read_xml_file(fname), teams=teams)
+    for fname in sorted(glob.glob(pattern))
+  }
+  pool = PoolFile.create(path, next(iter(brackets.values())), teams=teams)
+  pool.append(brackets)
+  return pool
+
+
+def convert_json_file(path, json_path, name, teams=TEAMS):
+  """Add the bracket in a `to_dict` JSON file (eg data.json) to a pool file.
+
+  Creates the pool file if it doesn't exist yet.
+  """
+  with open(json_path) as f:
+    bracket = ArrayBracket.from_dict(json.load(f), teams=teams)
+
+  pool = PoolFile(path, teams=teams) if os.path.exists(path) else PoolFile.create(path, bracket, teams=teams)
+  pool.append({name: bracket})
+  return pool
+
+
+if __name__ == '__main__':  # debug time
+  import time
+
+  pool = convert_xml_files('pool.bin')
+  print(f'{len(pool)} entries, {os.path.getsize(pool.path)} bytes')
+
+  # Stress test: loads of copies of the same entries.
+  brackets = pool.get_brackets()
+  for _ in range(7700):
+    pool.append(brackets)
+
+  t0 = time.time()
+  names, picks = pool.read()
+  print(f'Loaded {len(names)} entries in {1000 * (time.time() - t0):.0f} ms')
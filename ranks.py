@@ -0,0 +1,115 @@
+"""ranks.py
+
+Finishing-position distributions for pools too big for a score table.
+
+Scenarios are scored and ranked a chunk at a time, and only a histogram
+of each entry's finishing positions is kept, so memory grows with
+entries x bins instead of entries x scenarios. The first few positions
+get a bin each (the top-k counts); past that, bins double in width.
+"""
+import numpy as np
+
+import batch
+from bracket import TEAMS, ArrayBracket
+
+
+def get_rank_edges(num_entries, top_k=10):
+  """Bin edges for finishing positions: one bin per position up to top_k, then doubling."""
+  edges = list(range(1, min(top_k, num_entries) + 2))
+  while edges[-1] <= num_entries:
+    edges.append(min(2 * edges[-1] - 1, num_entries + 1))
+  return np.array(edges)
+
+
+def get_rank_histograms(hypo_bracket, picks, depth=3, edges=None, chunk_size=None, rules=None,
+                        collapse=False, teams=TEAMS):
+  """Count how often every entry finishes in each range of positions.
+
+  picks (array): (entries x games) picks, eg from `batch.get_pick_matrix`
+    or `PoolFile.read`.
+  edges (array): position bin edges, see `get_rank_edges`.
+  chunk_size (int): scenarios scored at once. Defaults to about 4M
+    scores' worth.
+  rules (scoring.ScoringRules): defaults to 320 points per round.
+  collapse (bool): only score one scenario per distinct score vector and
+    weight it by how many scenarios it stands for (see collapse.py).
+    Much faster for earlier rounds; counts are exact up to 2 ** 53.
+
+  Returns (edges, counts): counts[e, i] is the number of scenarios where
+  entry e finishes in a position from edges[i] up to (not including)
+  edges[i + 1]. Tied entries share the better position, as in
+  `batch.get_ranks`.
+  """
+  num_entries = len(picks)
+  if edges is None:
+    edges = get_rank_edges(num_entries)
+  num_bins = len(edges) - 1
+
+  base = ArrayBracket.from_tree(hypo_bracket, teams=teams)
+  slots, sides = batch.get_scenario_slots(hypo_bracket, depth)
+  weights = batch.get_weights(base, rules)
+
+  if chunk_size is None:
+    chunk_size = max(1, 2 ** 22 // num_entries)
+
+  # Position -> bin, looked up once instead of searching every rank.
+  bin_by_rank = np.searchsorted(edges, np.arange(num_entries + 1), side='right') - 1
+  offsets = np.arange(num_entries) * num_bins
+
+  if collapse:
+    from collapse import iter_class_outcomes
+    chunks = iter_class_outcomes(hypo_bracket, picks, depth, weights, chunk_size, teams)
+  else:
+    chunks = ((outcomes, None) for _, _, outcomes in batch.iter_outcome_chunks(base, slots, sides, chunk_size))
+
+  counts = np.zeros(num_entries * num_bins)
+  for outcomes, multiplicities in chunks:
+    ranks = batch.get_ranks(batch.get_score_table(outcomes, picks, weights))
+    cell_weights = None
+    if multiplicities is not None:
+      cell_weights = np.repeat(multiplicities.astype(np.float64), num_entries)
+    counts += np.bincount((bin_by_rank[ranks] + offsets).ravel(), weights=cell_weights, minlength=len(counts))
+
+  return edges, np.rint(counts).astype(np.int64).reshape(num_entries, num_bins)
+
+
+def rank_report(hypo_bracket, brackets=None, depth=3, top_k=10, rules=None, collapse=False):
+  """DataFrame of every entry's finishing-position distribution, indexed by entry name.
+
+  brackets (dict or PoolFile): the pool. A PoolFile is read straight
+    into a pick matrix, without building a bracket per entry.
+
+  Columns are position ranges ('1', '2', ..., '11-20', ...) with the
+  fraction of scenarios the entry finishes in each.
+  """
+  from pool import PoolFile
+
+  if brackets is None:
+    import scenarios
+    brackets = scenarios.load_brackets()
+
+  if isinstance(brackets, PoolFile):
+    names, picks = brackets.read()
+  else:
+    names, picks = list(brackets), batch.get_pick_matrix(brackets.values())
+
+  edges, counts = get_rank_histograms(
+    hypo_bracket, picks, depth, get_rank_edges(len(picks), top_k), rules=rules, collapse=collapse,
+  )
+  labels = [str(lo) if hi == lo + 1 else f'{lo}-{hi - 1}' for lo, hi in zip(edges[:-1], edges[1:])]
+
+  import pandas as pd
+  df = pd.DataFrame(counts / counts.sum(axis=1, keepdims=True), index=names, columns=labels)
+  return df
+
+
+if __name__ == '__main__':  # debug time
+  import scenarios
+
+  brackets = scenarios.load_brackets()
+  print(rank_report(scenarios.sweet_sixteen, brackets, top_k=3).round(3))
+
+  # Same thing from the full table.
+  df = scenarios.generate_dataframe_batch(scenarios.sweet_sixteen, brackets=brackets)
+  ranks = batch.get_ranks(df.to_numpy())
+  print((ranks == 1).mean(axis=0).round(3))
@@ -0,0 +1,216 @@
+"""regions.py
+
+Exact scenario analysis without enumerating the whole bracket.
+
+Scores are additive per game, and the four regions (the trees from
+`get_trees_by_depth(2)`) only affect each other through the champion each
+one sends to the final four. So each region's remaining games are
+enumerated on their own and tabulated by regional champion, and the
+regions only get combined at the final four: 4 x 2^7 region scenarios
+instead of 2^31 bracket scenarios from the round of 32.
+"""
+import numpy as np
+
+import batch
+from bracket import TEAMS, ArrayBracket
+
+
+# Heap slots of the two semifinals and the regional finals that feed them.
+SEMIFINALS = {1: (3, 4), 2: (5, 6)}
+
+
+def get_region(slot):
+  """Heap slot of the regional final above `slot`, or None for the final four."""
+  if slot < 3:
+    return None
+  while slot > 6:
+    slot = (slot - 1) // 2
+  return slot
+
+
+class RegionAnalysis:
+  def __init__(self, hypo_bracket, brackets, depth=3, rules=None, teams=TEAMS):
+    """
+    hypo_bracket (MatchupTree): the actual results so far. The trees in
+      `hypo_bracket.get_every_tree(depth)` are the games still to be played.
+    brackets (dict): MatchupTree or ArrayBracket entries by name.
+    rules (scoring.ScoringRules): defaults to 320 points per round.
+    """
+    if depth < 2:
+      raise ValueError('Regions can only be split up before the final four (depth >= 2).')
+    if depth > 4:
+      # 2^63 scenarios and up: counts no longer fit in an int64, or come
+      # out of a float64 FFT exactly.
+      raise ValueError('Scenario counts are only exact up to the round of 32 (depth <= 4).')
+
+    self.names = list(brackets)
+    self.base = ArrayBracket.from_tree(hypo_bracket, teams=teams)
+    self.picks = batch.get_pick_matrix(brackets.values(), teams=teams)
+    # (games x teams) points for a correct pick.
+    self.weights = batch.get_weight_table(batch.get_weights(self.base, rules), len(teams))
+
+    slots, sides = batch.get_scenario_slots(hypo_bracket, depth)
+    self.num_scenarios = 2 ** len(slots)
+
+    final = np.ones(self.base.num_games, dtype=bool)
+    final[slots] = False
+    self.scores_final = (self.picks[:, final] == self.base.games[final]) @ self.weights[final, self.base.games[final]]
+
+    # {regional final slot: {champion: (region scenarios x entries) scores}}
+    self.region_scores = {}
+    for region in (3, 4, 5, 6):
+      in_region = np.array([get_region(slot) == region for slot in slots])
+      self.region_scores[region] = self.get_region_scores(region, slots[in_region], sides[in_region])
+
+  def get_region_scores(self, region, slots, sides):
+    """Score every scenario of one region's remaining games, by champion."""
+    switches = batch.masks_to_switches(np.arange(2 ** len(slots), dtype=np.uint64), len(slots))
+    outcomes = batch.resolve_outcomes(self.base, slots, sides, switches)
+
+    weights = np.zeros_like(self.weights)
+    weights[slots] = self.weights[slots]
+    scores = batch.get_score_table(outcomes, self.picks, weights)
+
+    champions = outcomes[:, region]
+    return {champion: scores[champions == champion] for champion in np.unique(champions)}
+
+  def get_points(self, slot, winner):
+    """Points every entry gets if `winner` wins the game at `slot`."""
+    return self.weights[slot, winner] * (self.picks[:, slot] == winner)
+
+  def get_score_distributions(self):
+    """Exact number of scenarios giving each entry each final score.
+
+    Per-entry score histograms are combined in Fourier space, where adding
+    independent scores is a product and a fixed bonus is a phase shift.
+
+    Returns a DataFrame indexed by score, one column per entry.
+    """
+    if not np.array_equal(self.weights, np.rint(self.weights)):
+      raise ValueError('Score distributions need whole-number points.')
+
+    num_entries = len(self.names)
+    unit = max(1, int(np.gcd.reduce(np.rint(self.weights).astype(np.int64), axis=None)))
+
+    def to_units(points):
+      return np.rint(np.asarray(points) / unit).astype(np.int64)
+
+    length = int(to_units(self.weights.max(axis=1).sum())) + 1
+    freqs = np.arange(length // 2 + 1)
+    entry_offsets = np.arange(num_entries) * length
+
+    def get_spectrum(scores):
+      hist = np.bincount((to_units(scores) + entry_offsets).ravel(), minlength=num_entries * length)
+      return np.fft.rfft(hist.reshape(num_entries, length), axis=1)
+
+    def get_shift(points):
+      return np.exp(-2j * np.pi * np.outer(to_units(points), freqs) / length)
+
+    def combine(slot, spectra_1, spectra_2):
+      spectra = {}
+      for team_1, spectrum_1 in spectra_1.items():
+        for team_2, spectrum_2 in spectra_2.items():
+          both = spectrum_1 * spectrum_2
+          for winner in (team_1, team_2):
+            spectra[winner] = spectra.get(winner, 0) + both * get_shift(self.get_points(slot, winner))
+      return spectra
+
+    spectra = {
+      region: {champion: get_spectrum(scores) for champion, scores in tables.items()}
+      for region, tables in self.region_scores.items()
+    }
+    semis = {slot: combine(slot, spectra[a], spectra[b]) for slot, (a, b) in SEMIFINALS.items()}
+    total = sum(combine(0, semis[1], semis[2]).values())
+
+    counts = np.rint(np.fft.irfft(total, n=length, axis=1)).astype(np.int64)
+    assert (counts.sum(axis=1) == self.num_scenarios).all()
+
+    # Line every entry's histogram up on one score axis.
+    offsets = to_units(self.scores_final)
+    table = np.zeros((offsets.max() - offsets.min() + length, num_entries), dtype=np.int64)
+    for i, offset in enumerate(offsets - offsets.min()):
+      table[offset:offset + length, i] = counts[i]
+
+    index = (offsets.min() + np.arange(len(table))) * float(unit)
+    keep = table.any(axis=1)
+
+    import pandas as pd
+    df = pd.DataFrame(table[keep], index=index[keep], columns=self.names)
+    return df
+
+  def get_rank_distributions(self, block_size=2 ** 16):
+    """Exact number of scenarios giving each entry each finishing position.
+
+    Ranks need every entry's score at once, so here the regions are
+    combined into halves of the bracket, identical score vectors are
+    merged, and every pair of distinct halves is ranked in blocks. The
+    cost is the number of distinct pairs, which stays small when the pool
+    agrees on a lot of picks and grows quickly for big pools or early
+    rounds (see `simulate` for those).
+
+    Returns a DataFrame indexed by entry name, one column per finishing
+    position (1, 2, ...).
+    """
+    num_entries = len(self.names)
+
+    def merge(rows, counts):
+      rows, inverse = np.unique(rows, axis=0, return_inverse=True)
+      return rows, np.bincount(inverse.ravel(), weights=counts)
+
+    def combine(slot, tables_1, tables_2):
+      parts = {}
+      for team_1, (rows_1, counts_1) in tables_1.items():
+        for team_2, (rows_2, counts_2) in tables_2.items():
+          rows = (rows_1[:, None] + rows_2[None]).reshape(-1, num_entries)
+          counts = np.outer(counts_1, counts_2).ravel()
+          for winner in (team_1, team_2):
+            parts.setdefault(winner, []).append((rows + self.get_points(slot, winner), counts))
+      return {
+        winner: merge(np.concatenate([p[0] for p in part]), np.concatenate([p[1] for p in part]))
+        for winner, part in parts.items()
+      }
+
+    regions = {
+      region: {champion: merge(scores, np.ones(len(scores))) for champion, scores in tables.items()}
+      for region, tables in self.region_scores.items()
+    }
+    halves = [combine(slot, regions[a], regions[b]) for slot, (a, b) in SEMIFINALS.items()]
+
+    finish_counts = np.zeros(num_entries * num_entries)
+    entry_offsets = np.arange(num_entries) * num_entries
+    for team_1, (rows_1, counts_1) in halves[0].items():
+      for team_2, (rows_2, counts_2) in halves[1].items():
+        step = max(1, block_size // len(rows_2))
+        for winner in (team_1, team_2):
+          points = self.scores_final + self.get_points(0, winner)
+          for start in range(0, len(rows_1), step):
+            rows = (rows_1[start:start + step, None] + rows_2[None] + points).reshape(-1, num_entries)
+            counts = np.outer(counts_1[start:start + step], counts_2).ravel()
+            ranks = batch.get_ranks(rows)
+            finish_counts += np.bincount(
+              (entry_offsets + ranks.astype(np.int64) - 1).ravel(),
+              weights=np.repeat(counts, num_entries),
+              minlength=len(finish_counts),
+            )
+
+    import pandas as pd
+    df = pd.DataFrame(
+      np.rint(finish_counts).astype(np.int64).reshape(num_entries, num_entries),
+      index=self.names,
+      columns=range(1, num_entries + 1),
+    )
+    return df
+
+
+if __name__ == '__main__':  # debug time
+  import time
+
+  import scenarios
+
+  brackets = scenarios.load_brackets()
+
+  t0 = time.time()
+  analysis = RegionAnalysis(scenarios.sweet_sixteen, brackets, depth=4)
+  df = analysis.get_score_distributions()
+  print(f'Score distributions over {analysis.num_scenarios} scenarios in {time.time() - t0:.1f} s')
+  print(df.idxmax())
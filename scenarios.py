@@ -1,6 +1,11 @@
 """scenarios.py"""
 import xml.etree.ElementTree as ET
 
+import numpy as np
+
+import batch
+import loader
+from bracket import ArrayBracket
 from matchup import MatchupTree as MT
 
 
@@ -8,64 +13,120 @@ def read_xml_file(path):
   tree_file = ET.parse(path)
   elem_file = tree_file.getroot()
   return MT.from_xml(elem_file)
+
+
+def load_brackets(pattern='data/*.xml', base=None):
+  """Load every bracket, eg brackets['sar_1'] = MatchupTree('Gonzaga')"""
+  return loader.load_pool(pattern, base=base)
   
 
 # --------------------------------------------------------------------
 # Consider all possible remaining scenarios from this point,
 # and calculate scores accordingly.
 
-# Load a bracket with the correct sweet 16 teams with an arbitrary
-# path to the NC (Gonzaga over Arizona)
-sweet_sixteen = read_xml_file('data/sweet_sixteen.xml')
+# A bracket with the correct sweet 16 teams with an arbitrary
+# path to the NC (Gonzaga over Arizona). Loaded on first use as
+# `scenarios.sweet_sixteen`, rather than as a side effect of importing.
+_sweet_sixteen = None
+
+def get_sweet_sixteen():
+  global _sweet_sixteen
+  if _sweet_sixteen is None:
+    _sweet_sixteen = loader.read_xml_files(['data/sweet_sixteen.xml'])['data/sweet_sixteen.xml']
+  return _sweet_sixteen
 
-def generate_paths(depth=3):
-  """This is gross and could be made more elegant"""
 
+def __getattr__(name):
+  if name == 'sweet_sixteen':
+    return get_sweet_sixteen()
+  raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def get_num_trees(depth=3):
   # 1, 3, 7, 15, 31, 63
-  num_trees = 2 ** (depth + 1) - 1
-  
-  # Build a complete set of scenario paths
-  paths = ['']
-  # trees = [hypo_bracket]
-  # scores = []
-  for _ in range(num_trees):
-    expanded_paths = [path + str(0) for path in paths] + [path + str(1) for path in paths]
-    paths = expanded_paths
-  
-  return paths
+  return 2 ** (depth + 1) - 1
 
-# I want to make a recursive function but I cannot imagine what it looks like yet.
-# def test_scenarios(hypo_bracket, hypo_sub_bracket, guess_bracket, depth, score_dict):
-def test_scenarios(hypo_bracket, guess_bracket, depth=3):
 
-  trees = hypo_bracket.get_every_tree(depth)
+# A scenario is an int: bit i is set when tree i of
+# `hypo_bracket.get_every_tree(depth)` is switched.
+
+def iter_masks(depth=3):
+  """Lazily yield every scenario, in the same order as `generate_paths`."""
+  return iter(range(2 ** get_num_trees(depth)))
+
+
+def iter_mask_chunks(depth=3, chunk_size=2 ** 16):
+  """Yield every scenario in NumPy arrays of at most `chunk_size` masks."""
+  num_scenarios = 2 ** get_num_trees(depth)
+  for start in range(0, num_scenarios, chunk_size):
+    yield np.arange(start, min(start + chunk_size, num_scenarios), dtype=np.uint64)
+
+
+def mask_to_path(mask, num_trees):
+  """eg mask_to_path(0b011, 3) == '110'"""
+  return format(mask, f'0{num_trees}b')[::-1] if num_trees else ''
+
 
-  # Consider the switched and unswitched cases for each tree,
-  # in every configuration.
+def path_to_mask(path):
+  return int(path[::-1], 2) if path else 0
+
+
+def get_switched_trees(trees, mask):
+  return [tree for i, tree in enumerate(trees) if mask >> i & 1]
+
+
+def get_winners(trees, mask):
+  """Return (winner, loser) names of every tree in the scenario `mask`.
   
-  # Build a complete set of scenario paths
-  paths = generate_paths(depth)
+  The trees are switched back afterwards.
+  """
+  switched = get_switched_trees(trees, mask)
+  for tree in switched:
+    tree.switch_winner()
+  try:
+    return [(tree.winner_name, tree.loser_name) for tree in trees]
+  finally:
+    for tree in switched:
+      tree.switch_winner()
+
+
+def generate_paths(depth=3):
+  """Every scenario as a string of '0's and '1's (materializes them all)."""
+  num_trees = get_num_trees(depth)
+  return [mask_to_path(mask, num_trees) for mask in iter_masks(depth)]
+
 
-  # print(paths)
-  # print(len(paths))  # 2, 8, 128, 32768
+def iter_scenarios(hypo_bracket, brackets, depth=3, rules=None):
+  """Yield (mask, {name: score}) for every scenario, one at a time.
 
-  # score each scenario
-  scores = dict()
-  for path in paths:
+  rules (scoring.ScoringRules): defaults to 320 points per round.
+  """
+  trees = hypo_bracket.get_every_tree(depth)
+
+  for mask in iter_masks(depth):
     # switch/don't switch the winner of the tree at each position
-    for i, is_switched in enumerate(path):
-      if bool(int(is_switched)):
-        trees[i].switch_winner()
+    switched = get_switched_trees(trees, mask)
+    for tree in switched:
+      tree.switch_winner()
 
     # score the bracket corresponding to this path
-    scores[path] = guess_bracket.score(hypo_bracket)
+    scores = {name: bracket.score(hypo_bracket, rules) for name, bracket in brackets.items()}
 
     # switch back
-    for i, is_switched in enumerate(path):
-      if bool(int(is_switched)):
-        trees[i].switch_winner()
-    
-  return scores
+    for tree in switched:
+      tree.switch_winner()
+
+    yield mask, scores
+
+
+# I want to make a recursive function but I cannot imagine what it looks like yet.
+# def test_scenarios(hypo_bracket, hypo_sub_bracket, guess_bracket, depth, score_dict):
+def test_scenarios(hypo_bracket, guess_bracket, depth=3, rules=None):
+  num_trees = get_num_trees(depth)
+  return {
+    mask_to_path(mask, num_trees): scores[None]
+    for mask, scores in iter_scenarios(hypo_bracket, {None: guess_bracket}, depth, rules)
+  }
 
 
 # Load a bracket that is affected by these two teams in the NC.
@@ -83,10 +144,17 @@ def test_scenarios(hypo_bracket, guess_bracket, depth=3):
 # scores = test_scenarios(sweet_sixteen, bracket)
 # print(scores)
 
-def max_points(fname):
-  bracket = read_xml_file(fname)
-  scores = test_scenarios(sweet_sixteen, bracket)
-  print(f'{fname}: {max(scores.values())}')
+def max_points(fname, depth=3):
+  bracket = loader.read_xml_files([fname])[fname]
+  score, _ = bracket.max_possible_score(get_sweet_sixteen(), depth)
+  print(f'{fname}: {score}')
+
+
+def max_points_report(hypo_bracket, depth=3, brackets=None, rules=None):
+  """Max possible score, and the scenario mask that gets it, for every entry."""
+  if brackets is None:
+    brackets = load_brackets()
+  return {name: bracket.max_possible_score(hypo_bracket, depth, rules) for name, bracket in brackets.items()}
 
 # max_points('data/kam_1.xml')
 # max_points('data/kam_1.xml')
@@ -99,46 +167,86 @@ def max_points(fname):
 # ---------------------------------------------------------------------
 
 def print_winners(trees, path):
-  big_daddy = trees[0]
-  for i, bin_string in enumerate(path):
-    is_switched = bool(int(bin_string))
-    if is_switched:
-      trees[i].switch_winner()
-  for tree in trees:
-    print(f'{tree.winner_name} over {tree.loser_name}')
+  """path (str or int): scenario as a path string or a mask."""
+  mask = path_to_mask(path) if isinstance(path, str) else path
+  for winner_name, loser_name in get_winners(trees, mask):
+    print(f'{winner_name} over {loser_name}')
 
 
-def generate_dataframe(hypo_bracket):
+def generate_dataframe(hypo_bracket, depth=3, brackets=None, rules=None):
   """Build a DataFrame of scenarios"""
-  trees = hypo_bracket.get_every_tree(depth=3)
+  if brackets is None:
+    brackets = load_brackets()
 
-  # Build a complete set of scenario paths
-  paths = generate_paths(depth=3)
+  num_trees = get_num_trees(depth)
+  paths = []
+  scores = []
+  for mask, mask_scores in iter_scenarios(hypo_bracket, brackets, depth, rules):
+    paths.append(mask_to_path(mask, num_trees))
+    scores.append(mask_scores)
 
-  # Load every bracket
-  # eg brackets['sar_1'] = MatchupTree('Gonzaga')
-  import glob
-  brackets = {fname.split('/')[1].split('.')[0]: read_xml_file(fname) for fname in glob.glob('data/*.xml')}
+  import pandas as pd
+  df = pd.DataFrame(scores, index=paths)
+  return df
 
-  # score each scenario
-  scores = []
-  for path in paths:
-    # switch/don't switch the winner of the tree at each position
-    for i, is_switched in enumerate(path):
-      if bool(int(is_switched)):
-        trees[i].switch_winner()
 
-    # score the bracket corresponding to this path
-    # scores[path] = bracket.score(sweet_sixteen)
-    scores.append({name: bracket.score(hypo_bracket) for name, bracket in brackets.items()})
+def iter_dataframes(hypo_bracket, depth=3, brackets=None, chunk_size=2 ** 16, rules=None):
+  """Stream the scenario table as DataFrames indexed by scenario mask.
 
-    # switch back
-    for i, is_switched in enumerate(path):
-      if bool(int(is_switched)):
-        trees[i].switch_winner()
+  Only one chunk of scenarios is held in memory at a time, so this works
+  for depths where `generate_dataframe` would never fit.
+  """
+  if brackets is None:
+    brackets = load_brackets()
+
+  picks = batch.get_pick_matrix(brackets.values())
+  weights = batch.get_weights(ArrayBracket.from_tree(hypo_bracket), rules)
+  num_trees = get_num_trees(depth)
 
   import pandas as pd
-  df = pd.DataFrame(scores, index=paths)
+  for masks in iter_mask_chunks(depth, chunk_size):
+    switches = batch.masks_to_switches(masks, num_trees)
+    outcomes = batch.get_outcome_matrix(hypo_bracket, switches, depth)
+    yield pd.DataFrame(batch.get_score_table(outcomes, picks, weights), index=masks, columns=list(brackets))
+
+
+# ---------------------------------------------------------------------
+# Batch versions of the above. Same results, but every scenario and
+# every entry gets scored in one shot (see batch.py).
+
+def get_score_table(hypo_bracket, picks, depth=3, workers=1, rules=None):
+  """Every entry's score in every scenario, on `workers` processes.
+
+  workers (int): 1 scores in this process; None uses every CPU.
+  """
+  if workers == 1:
+    switches = batch.masks_to_switches(np.arange(2 ** get_num_trees(depth), dtype=np.uint64), get_num_trees(depth))
+    outcomes = batch.get_outcome_matrix(hypo_bracket, switches, depth)
+    weights = batch.get_weights(ArrayBracket.from_tree(hypo_bracket), rules)
+    return batch.get_score_table(outcomes, picks, weights)
+
+  import parallel
+  return parallel.get_score_table_parallel(hypo_bracket, picks, depth, workers=workers, rules=rules)
+
+
+def test_scenarios_batch(hypo_bracket, guess_bracket, depth=3, workers=1, rules=None):
+  """Drop-in replacement for `test_scenarios`."""
+  paths = generate_paths(depth)
+  picks = batch.get_pick_matrix([guess_bracket])
+  scores = get_score_table(hypo_bracket, picks, depth, workers, rules)[:, 0]
+  return dict(zip(paths, scores.tolist()))
+
+
+def generate_dataframe_batch(hypo_bracket, depth=3, brackets=None, workers=1, rules=None):
+  """Drop-in replacement for `generate_dataframe`."""
+  if brackets is None:
+    brackets = load_brackets()
+
+  paths = generate_paths(depth)
+  picks = batch.get_pick_matrix(brackets.values())
+
+  import pandas as pd
+  df = pd.DataFrame(get_score_table(hypo_bracket, picks, depth, workers, rules), index=paths, columns=list(brackets))
   return df
 
 # Each of these represents the exact path of one of the S16 teams.
@@ -160,3 +268,26 @@ def generate_dataframe(hypo_bracket):
 #   sweet_sixteen.loser.loser.loser.winner,
 #   sweet_sixteen.loser.loser.loser.loser,
 # ]
+
+
+def test_scenarios_gray(hypo_bracket, guess_bracket, depth=3, rules=None):
+  """Drop-in replacement for `test_scenarios`, scored incrementally."""
+  paths = generate_paths(depth)
+  picks = batch.get_pick_matrix([guess_bracket])
+  weights = batch.get_weights(ArrayBracket.from_tree(hypo_bracket), rules)
+  scores = batch.get_score_table_gray(hypo_bracket, picks, depth, weights)[:, 0]
+  return dict(zip(paths, scores.tolist()))
+
+
+def generate_dataframe_gray(hypo_bracket, depth=3, brackets=None, rules=None):
+  """Drop-in replacement for `generate_dataframe`, scored incrementally."""
+  if brackets is None:
+    brackets = load_brackets()
+
+  paths = generate_paths(depth)
+  picks = batch.get_pick_matrix(brackets.values())
+
+  import pandas as pd
+  weights = batch.get_weights(ArrayBracket.from_tree(hypo_bracket), rules)
+  df = pd.DataFrame(batch.get_score_table_gray(hypo_bracket, picks, depth, weights), index=paths, columns=list(brackets))
+  return df
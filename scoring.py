@@ -0,0 +1,161 @@
+"""scoring.py
+
+Pool scoring rules other than the default 320 points per round.
+
+A ScoringRules object describes the rules: points per correct pick in
+each round, a bonus for picking upsets by seed, and per-team
+multipliers. It is compiled once per bracket base into a table of the
+points a correct pick is worth for every (game, team), so scoring
+with custom rules costs the same as scoring with the default ones.
+
+Anything that takes `rules=` (MatchupTree.score, ArrayBracket.score,
+the scenario functions) accepts one of these. The batch engines take the
+compiled table itself as their `weights`.
+"""
+import numpy as np
+
+from bracket import TEAMS, ArrayBracket, get_heap_nodes
+from matchup import MatchupTree
+
+
+class ScoringRules:
+  def __init__(self, round_points=None, seeds=None, upset_bonus=0, multipliers=None):
+    """
+    round_points (list): points for a correct pick at each depth, same
+      numbering as `get_names_by_depth` (0 = champion). Defaults to
+      320 points per round, split between that round's games.
+    seeds (dict): seed of every team, eg {'Gonzaga': 1}. Only needed for
+      an upset bonus.
+    upset_bonus (float): extra points per seed line a correctly picked
+      winner is below the best seed that could have won that game.
+    multipliers (dict): factor applied to all points for picking a given
+      team, eg {team: seed} for a seed-multiplier pool.
+    """
+    if upset_bonus and seeds is None:
+      raise ValueError('An upset bonus needs seeds.')
+
+    self.round_points = round_points
+    self.seeds = seeds or {}
+    self.upset_bonus = upset_bonus
+    self.multipliers = multipliers or {}
+
+    # Compiled tables by (registry, bracket base).
+    self._tables = {}
+    self._points_by_depth = {}
+
+  def get_round_points(self, depth):
+    if self.round_points is None:
+      return 320 / 2 ** depth
+    return self.round_points[depth]
+
+  def get_points(self, depth, team, best_seed=None):
+    """Points for correctly picking `team` to win a game at `depth`."""
+    points = self.get_round_points(depth)
+    if self.upset_bonus:
+      points += self.upset_bonus * max(0, self.seeds[team] - best_seed)
+    return points * self.multipliers.get(team, 1)
+
+  def compile(self, bracket, teams=TEAMS):
+    """(games x teams) points table for brackets sharing `bracket`'s base.
+
+    bracket (MatchupTree or ArrayBracket): any bracket with the right base.
+    Row g is heap slot g (see ArrayBracket); column t is team ID t in
+    `teams`. Teams that can't reach a game get 0. Read-only, and built
+    once per base.
+    """
+    if isinstance(bracket, MatchupTree):
+      key = (id(teams), bracket.base_hash)
+    else:
+      key = (id(bracket.teams), bracket.winners[bracket.num_games:].tobytes())
+    if key in self._tables:
+      return self._tables[key]
+
+    if isinstance(bracket, MatchupTree):
+      bracket = ArrayBracket.from_tree(bracket, teams=teams)
+    num_games = bracket.num_games
+    leaves = bracket.winners[num_games:]
+
+    table = np.zeros((num_games, len(bracket.teams)))
+    for depth in range(bracket.depth + 1):
+      lo, hi = 2 ** depth - 1, 2 ** (depth + 1) - 1
+      for block, slot in enumerate(range(lo, hi)):
+        # Teams at or below this game: a contiguous block of leaves.
+        team_ids = np.array_split(leaves, hi - lo)[block]
+        names = [bracket.teams.name(team_id) for team_id in team_ids]
+        best_seed = min(self.seeds[name] for name in names) if self.upset_bonus else None
+        for team_id, name in zip(team_ids, names):
+          table[slot, team_id] = self.get_points(depth, name, best_seed)
+
+    table.flags.writeable = False
+    self._tables[key] = table
+    return table
+
+  def get_points_by_depth(self, tree):
+    """[{team: points}] by depth, the compiled table as MatchupTree.score sees it."""
+    key = tree.base_hash
+    if key not in self._points_by_depth:
+      teams = TEAMS
+      table = self.compile(tree, teams=teams)
+      nodes = get_heap_nodes(tree)
+
+      points_by_depth = []
+      for depth in range(tree.depth + 1):
+        lo, hi = 2 ** depth - 1, 2 ** (depth + 1) - 1
+        points = {}
+        for slot in range(lo, hi):
+          for team in nodes[slot].get_names_by_depth(tree.depth - depth + 1):
+            points[team] = table[slot, teams.ids[team]]
+        points_by_depth.append(points)
+
+      self._points_by_depth[key] = points_by_depth
+    return self._points_by_depth[key]
+
+  def score_by_depth(self, bracket, actual, depth):
+    """Same as `bracket.score_by_depth(actual, depth)`, under these rules."""
+    if isinstance(bracket, ArrayBracket):
+      lo, hi = 2 ** depth - 1, 2 ** (depth + 1) - 1
+      table = self.compile(actual)
+      games = actual.winners[lo:hi]
+      return float(table[np.arange(lo, hi), games] @ (bracket.winners[lo:hi] == games))
+
+    points = self.get_points_by_depth(actual)[depth]
+    teams = set(actual.get_names_by_depth(depth))
+    return sum([points[team] for team in bracket.get_names_by_depth(depth) if team in teams])
+
+  def score(self, bracket, actual):
+    """Same as `bracket.score(actual)`, under these rules."""
+    if isinstance(bracket, ArrayBracket):
+      table = self.compile(actual)
+      games = actual.games
+      return float(table[np.arange(len(games)), games] @ (bracket.games == games))
+    return sum([self.score_by_depth(bracket, actual, i) for i in range(bracket.depth + 1)])
+
+
+if __name__ == '__main__':  # debug time
+  import glob
+  import timeit
+
+  import scenarios
+
+  actual_tree = scenarios.sweet_sixteen
+  actual = ArrayBracket.from_tree(actual_tree)
+
+  # The default rules should score exactly like the hard-coded ones.
+  default = ScoringRules()
+  for fname in sorted(glob.glob('data/*.xml')):
+    tree = scenarios.read_xml_file(fname)
+    bracket = ArrayBracket.from_tree(tree)
+    assert tree.score(actual_tree, rules=default) == tree.score(actual_tree), fname
+    assert bracket.score(actual, rules=default) == bracket.score(actual), fname
+
+  # Every team a 1 seed except for a few, and 10x for the champion's pickers.
+  seeds = dict.fromkeys(actual_tree.get_names_by_depth(actual_tree.depth + 1), 1)
+  seeds.update({'Arizona': 4, 'Houston': 5})
+  rules = ScoringRules(round_points=[320, 160, 80, 40, 20, 10, 0], seeds=seeds, upset_bonus=5,
+                       multipliers={'Gonzaga': 10})
+  tree = scenarios.read_xml_file('data/sally.xml')
+  bracket = ArrayBracket.from_tree(tree)
+  print(tree.score(actual_tree, rules=rules), bracket.score(actual, rules=rules))
+
+  print(timeit.timeit(lambda: tree.score(actual_tree), number=1000), 'ms per tree score')
+  print(timeit.timeit(lambda: tree.score(actual_tree, rules=rules), number=1000), 'ms per tree score with rules')
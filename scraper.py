@@ -1,16 +1,32 @@
+import re
+
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 
 from matchup import MatchupTree
 
+try:
+  import lxml  # noqa: F401
+  PARSER = 'lxml'  # much faster, if it's installed
+except ImportError:
+  PARSER = 'html.parser'
+
 
 BASE_URL = 'https://fantasy.espn.com/tournament-challenge-bracket/2022/en/entry'
 NUM_GAMES_PER_ROUND = [32, 16, 8, 4, 2, 1]
 
+# Only the games (<... class='... m_{matchup_num}'>) and the champion matter,
+# so don't bother building the rest of the page.
+BRACKET_STRAINER = SoupStrainer(class_=re.compile(r'(^|\s)(m_\d+|champion)(\s|$)'))
+
+
+def get_entry_url(entry_id, base_url=BASE_URL):
+  return f'{base_url}?entryID={entry_id}'
+
 
 def get_bracket_soup(entry_id):
-  page = requests.get(f'{BASE_URL}?entryID={entry_id}')
-  return BeautifulSoup(page.content, 'html.parser')
+  page = requests.get(get_entry_url(entry_id))
+  return BeautifulSoup(page.content, PARSER)
 
 
 def get_game_tag(soup, round, winner):
@@ -37,6 +53,33 @@ def get_game_tag(soup, round, winner):
   return soup.find(is_right_game)
 
 
+def get_round(matchup_num):
+  """eg matchup 1-32 is round 1, 33-48 is round 2, ..., 63 is round 6."""
+  num_games_before = 0
+  for round, num_games in enumerate(NUM_GAMES_PER_ROUND, 1):
+    num_games_before += num_games
+    if matchup_num <= num_games_before:
+      return round
+  raise ValueError(f'No matchup number {matchup_num}')
+
+
+def index_game_tags(soup):
+  """Find every game in one pass: {(round, winner): game tag}.
+
+  `get_game_tag` does the same lookup, but rescans the whole page for
+  every game.
+  """
+  index = {}
+  for tag in soup.find_all(class_='slots'):
+    winner_tag = get_winner_tag(tag)
+    if winner_tag is None:
+      continue
+    matchup_num = int(tag.parent['class'][1].split('_')[1])
+    index[(get_round(matchup_num), winner_tag.find(class_='name').text)] = tag
+
+  return index
+
+
 def get_winner_tag(game_tag):
   return game_tag.find(class_='selectedToAdvance')
 
@@ -50,8 +93,10 @@ def get_loser_tag(game_tag):
   return game_tag.find(class_=loser_slot)
 
 
-def make_matchup_tree(soup, round=1, winner=None):
-  game_tag = get_game_tag(soup, round, winner)
+def make_matchup_tree(soup, round=1, winner=None, index=None):
+  if index is None:
+    index = index_game_tags(soup)
+  game_tag = index[(round, winner)]
 
   # winner_tag = get_winner_tag(game_tag)
   loser_tag = get_loser_tag(game_tag)
@@ -63,9 +108,9 @@ def make_matchup_tree(soup, round=1, winner=None):
     # print(game_tag.find_all(class_='picked'))
     # print('')
     # winner_tag = 
-    winner_tree = make_matchup_tree(soup, round=round-1, winner=winner)
+    winner_tree = make_matchup_tree(soup, round=round-1, winner=winner, index=index)
     loser_name = loser_tag.find(class_='picked').find(class_='name').text
-    loser_tree = make_matchup_tree(soup, round=round-1, winner=loser_name)
+    loser_tree = make_matchup_tree(soup, round=round-1, winner=loser_name, index=index)
     # matchups_prev = [
     #   make_matchup_tree(soup, round=round-1, winner=elem.find(class_='name').text)
     #   for elem in game_tag.find_all(class_='picked')
@@ -76,7 +121,15 @@ def make_matchup_tree(soup, round=1, winner=None):
 
 
 def make_bracket(entry_id):
-  soup = get_bracket_soup(entry_id)
+  return make_bracket_from_soup(get_bracket_soup(entry_id))
+
+
+def parse_bracket(content):
+  """Build the MatchupTree for an entry page's raw HTML."""
+  return make_bracket_from_soup(BeautifulSoup(content, PARSER, parse_only=BRACKET_STRAINER))
+
+
+def make_bracket_from_soup(soup):
   team_nat_champ = soup.find(class_='champion').find(class_='picked').find(class_='name').text
   
   # Start with the national championship game and recursively build the matchup tree.
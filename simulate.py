@@ -0,0 +1,117 @@
+"""simulate.py
+
+Monte Carlo version of the scenario analysis, for when there are too
+many scenarios to enumerate or they shouldn't all count the same.
+
+Remaining games are sampled in batches straight into NumPy outcome
+matrices, then scored and ranked with the batch engine.
+"""
+import numpy as np
+
+import batch
+from bracket import TEAMS, ArrayBracket
+from ranks import get_rank_edges
+
+
+def sample_outcomes(base, slots, sides, num_samples, rng, game_probs=None, ratings=None):
+  """Sample the remaining games, as a (samples x games) array of winners.
+
+  game_probs (sequence): for each remaining tree, the probability that its
+    current winner wins. Defaults to a coin flip.
+  ratings (array): team strength by team ID. If given, the winner of every
+    remaining game is drawn with P(a beats b) = ratings[a] / (ratings[a] + ratings[b])
+    and `game_probs` is ignored.
+  """
+  if ratings is None:
+    if game_probs is None:
+      game_probs = np.full(len(slots), 0.5)
+    switches = rng.random((num_samples, len(slots))) >= np.asarray(game_probs)
+    return batch.resolve_outcomes(base, slots, sides, switches)
+
+  winners = np.tile(base.winners, (num_samples, 1))
+  for slot in sorted(slots, reverse=True):
+    first, second = winners[:, 2 * slot + 1], winners[:, 2 * slot + 2]
+    prob_first = ratings[first] / (ratings[first] + ratings[second])
+    winners[:, slot] = np.where(rng.random(num_samples) < prob_first, first, second)
+
+  return winners[:, :base.num_games]
+
+
+def simulate(hypo_bracket, brackets, depth=3, num_samples=10 ** 6, batch_size=None,
+             seed=None, game_probs=None, ratings=None, rules=None, top_k=10, teams=TEAMS):
+  """Simulate the rest of the tournament and summarize how every entry does.
+
+  hypo_bracket (MatchupTree): the actual results so far. The trees in
+    `hypo_bracket.get_every_tree(depth)` are the games still to be played.
+  brackets (dict): MatchupTree or ArrayBracket entries by name.
+  game_probs (sequence): see `sample_outcomes`.
+  ratings (dict): team strength by name, see `sample_outcomes`. Teams
+    left out get a rating of 1.
+  batch_size (int): samples held in memory at once. Defaults to about 4M
+    scores' worth.
+  rules (scoring.ScoringRules): defaults to 320 points per round.
+  top_k (int): positions that get a column each; past that, position
+    ranges double in width (see `ranks.get_rank_edges`).
+
+  Returns a DataFrame indexed by entry name with the probability of
+  winning (ties for first count as a win), the expected score, and the
+  probability of each finishing position or range of positions (columns
+  '1', '2', ..., '11-20', ... as in `ranks.rank_report`).
+  """
+  rng = np.random.default_rng(seed)
+
+  base = ArrayBracket.from_tree(hypo_bracket, teams=teams)
+  slots, sides = batch.get_scenario_slots(hypo_bracket, depth)
+  picks = batch.get_pick_matrix(brackets.values(), teams=teams)
+  weights = batch.get_weights(base, rules)
+
+  if ratings is not None:
+    ratings_by_id = np.ones(len(teams))
+    for name, rating in ratings.items():
+      if name in teams:
+        ratings_by_id[teams.intern(name)] = rating
+    ratings = ratings_by_id
+
+  num_entries = len(picks)
+  if batch_size is None:
+    batch_size = max(1, 2 ** 22 // num_entries)
+
+  # Position -> bin, looked up once instead of searching every rank.
+  edges = get_rank_edges(num_entries, top_k)
+  num_bins = len(edges) - 1
+  bin_by_rank = np.searchsorted(edges, np.arange(num_entries + 1), side='right') - 1
+  offsets = np.arange(num_entries) * num_bins
+
+  score_totals = np.zeros(num_entries)
+  finish_counts = np.zeros(num_entries * num_bins, dtype=np.int64)
+
+  for start in range(0, num_samples, batch_size):
+    size = min(batch_size, num_samples - start)
+    outcomes = sample_outcomes(base, slots, sides, size, rng, game_probs, ratings)
+    scores = batch.get_score_table(outcomes, picks, weights)
+    ranks = batch.get_ranks(scores)
+
+    score_totals += scores.sum(axis=0)
+    finish_counts += np.bincount((bin_by_rank[ranks] + offsets).ravel(), minlength=len(finish_counts))
+
+  finish = finish_counts.reshape(num_entries, num_bins) / num_samples
+  labels = [str(lo) if hi == lo + 1 else f'{lo}-{hi - 1}' for lo, hi in zip(edges[:-1], edges[1:])]
+
+  import pandas as pd
+  df = pd.DataFrame(finish, index=list(brackets), columns=labels)
+  df.insert(0, 'expected_score', score_totals / num_samples)
+  df.insert(0, 'win', finish[:, 0])
+  return df
+
+
+if __name__ == '__main__':  # debug time
+  import time
+
+  import scenarios
+
+  brackets = scenarios.load_brackets()
+
+  t0 = time.time()
+  df = simulate(scenarios.sweet_sixteen, brackets, num_samples=10 ** 6, seed=2022)
+  print(f'1M brackets in {time.time() - t0:.1f} s')
+  print(df[['win', 'expected_score', '1', '2', '3']])
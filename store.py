@@ -0,0 +1,97 @@
+"""store.py
+
+Write the scenario x entry score table to disk a chunk at a time, and
+read it back memory-mapped.
+
+A table is a directory holding:
+  scores.npy: (scenarios x entries) integer scores, column-major so each
+    entry's scores are contiguous. Row i is scenario mask i.
+  meta.json: entry names and the depth the scenarios were taken at.
+"""
+import json
+import os
+
+import numpy as np
+
+import batch
+from bracket import TEAMS, ArrayBracket
+
+
+def write_score_table(path, hypo_bracket, brackets, depth=3, chunk_size=2 ** 16, rules=None, teams=TEAMS):
+  """Score every scenario for every entry and stream the results to `path`.
+
+  Only `chunk_size` scenarios are held in memory at a time.
+
+  rules (scoring.ScoringRules): defaults to 320 points per round.
+  """
+  base = ArrayBracket.from_tree(hypo_bracket, teams=teams)
+  slots, sides = batch.get_scenario_slots(hypo_bracket, depth)
+  picks = batch.get_pick_matrix(brackets.values(), teams=teams)
+  weights = batch.get_weights(base, rules)
+
+  if not np.array_equal(weights, np.rint(weights)):
+    raise ValueError('Scores can only be stored as integers.')
+  max_score = weights.sum() if weights.ndim == 1 else weights.max(axis=1).sum()
+  dtype = np.min_scalar_type(int(max_score))
+
+  os.makedirs(path, exist_ok=True)
+  with open(os.path.join(path, 'meta.json'), 'w') as f:
+    json.dump({'names': list(brackets), 'depth': depth}, f, indent=2)
+
+  num_scenarios = 2 ** len(slots)
+  scores = np.lib.format.open_memmap(
+    os.path.join(path, 'scores.npy'),
+    mode='w+',
+    dtype=dtype,
+    shape=(num_scenarios, len(picks)),
+    fortran_order=True,
+  )
+  for start, _, outcomes in batch.iter_outcome_chunks(base, slots, sides, chunk_size):
+    scores[start:start + len(outcomes)] = batch.get_score_table(outcomes, picks, weights)
+
+  scores.flush()
+  del scores
+
+
+class ScoreTable:
+  """Read-only, memory-mapped view of a table written by `write_score_table`."""
+
+  def __init__(self, path):
+    with open(os.path.join(path, 'meta.json')) as f:
+      meta = json.load(f)
+
+    self.names = meta['names']
+    self.depth = meta['depth']
+    self.scores = np.load(os.path.join(path, 'scores.npy'), mmap_mode='r')
+
+  def __len__(self):
+    return len(self.scores)
+
+  def get_entry(self, name):
+    """Every scenario's score for one entry, indexed by mask."""
+    return self.scores[:, self.names.index(name)]
+
+  def get_scenario(self, mask):
+    return dict(zip(self.names, self.scores[mask].tolist()))
+
+  def to_dataframe(self, start=0, stop=None):
+    """Load a range of scenarios into a DataFrame indexed by mask."""
+    stop = len(self) if stop is None else stop
+
+    import pandas as pd
+    df = pd.DataFrame(
+      np.asarray(self.scores[start:stop]),
+      index=np.arange(start, stop, dtype=np.uint64),
+      columns=self.names,
+    )
+    return df
+
+
+if __name__ == '__main__':  # debug time
+  import scenarios
+
+  write_score_table('scenario_scores', scenarios.sweet_sixteen, scenarios.load_brackets())
+  table = ScoreTable('scenario_scores')
+  print(table.scores.dtype, table.scores.shape)
+  print(table.get_entry('sally').max())
+  print(table.to_dataframe(0, 4))